@@ -9,6 +9,7 @@ from sources import sources
 DEBUGGING = True
 LOGGING = True
 PARALLEL_WORKERS = 2
+#LONGEST_FIRST = False
 
 OUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'out')
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
@@ -18,11 +19,18 @@ LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
 
 SOURCES = ["<source_one>", "<source_two>"]
 #DDIFF_SOURCE = sources["<source_one>"]
+#DIFF_ENGINE = "sql"
+#MAX_ROWS = None
+#PARALLEL_FETCH = True
 
 specs = {
     "<descriptive spec name>": {
         #"tags": ["<tag1>", "<tag2>"],
-        #"doc": "<comments on the spec>"
+        #"doc": "<comments on the spec>",
+        #"engine": DIFF_ENGINE,
+        #"buckets": 16,
+        #"max_rows": MAX_ROWS,
+        #"parallel_fetch": PARALLEL_FETCH
 
         #
         # level 1
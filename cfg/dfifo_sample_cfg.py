@@ -15,6 +15,7 @@ LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
 #ENCODING = 'UTF-8'
 #CSV_DIALECT = 'excel'
 #CSV_DELIMITER = ';'
+#CSV_ENGINE = 'python'
 
 # defaults to ISO 86101; use '%c' to align with locale
 #DATETIME_FORMAT = '%c'
@@ -32,8 +33,10 @@ specs = {
             #"encoding": ENCODING,
             #"csv_dialect": CSV_DIALECT,
             #"csv_delimiter": CSV_DELIMITER,
+            #"csv_engine": CSV_ENGINE,
             #"text_lines": False,
-            #"transformer": lambda row: (row[3], row[0]) if row[3] else None
+            #"transformer": lambda row: (row[3], row[0]) if row[3] else None,
+            #"transformer_batch": False
         },
         "fo": {
             "file": "example.html",
@@ -46,6 +49,7 @@ specs = {
             #"csv.dec_separator": '.',
             #"json.encoding": ENCODING,
             #"json.template": "dfifo_sample_out.json.jinja",
+            #"parquet.compression": "snappy",
             #"html.encoding": ENCODING,
             #"html.dec_separator": '.',
             #"html.title": "Example HTML formatted data",
@@ -9,6 +9,7 @@ from sources import sources
 DEBUGGING = True
 LOGGING = True
 PARALLEL_WORKERS = 2
+#LONGEST_FIRST = False
 
 OUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'out')
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
@@ -24,6 +25,8 @@ LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
 
 SOURCE = "<source_one>"
 #PRESERVE_N_TRACES = 10
+#FETCH_ROWS = 5000
+#PARTITION_QUEUE_SIZE = 4
 
 specs = {
     "<descriptive spec name>": {
@@ -34,13 +37,18 @@ specs = {
         #"bind_args": {},
         "file": "example.html"
         #"rows_per_file": 100
+        #"fetch_rows": FETCH_ROWS,
+        #"partition_by": {"column": "id", "buckets": 4},
+        #"watermark": {"column": "id", "initial": 0},
         #"header": []
         #"csv.encoding": ENCODING,
         #"csv.dialect": CSV_DIALECT,
         #"csv.delimiter": CSV_DELIMITER,
         #"csv.dec_separator": '.',
         #"json.encoding": ENCODING,
+        #"json.lines": False,
         #"json.template": "dget_sample_out.json.jinja"
+        #"parquet.compression": "snappy",
         #"html.encoding": ENCODING,
         #"html.dec_separator": '.',
         #"html.title": "<descriptive HTML title>",
@@ -9,6 +9,7 @@ from sources import sources
 DEBUGGING = True
 LOGGING = True
 PARALLEL_WORKERS = 2
+#LONGEST_FIRST = False
 
 IN_DIR = os.path.join(os.path.dirname(__file__), '..', 'in')
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
@@ -16,9 +17,13 @@ LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
 #ENCODING = 'UTF-8'
 #CSV_DIALECT = 'excel'
 #CSV_DELIMITER = ';'
+#CSV_ENGINE = 'python'
 
 SOURCE = "<source_one>"
 #PRESERVE_N_LOADS = 10
+#BATCH_SIZE = 1000
+#INSERT_QUEUE_SIZE = 4
+#CHECKPOINT_BATCHES = 0
 
 specs = {
     "<descriptive spec name>": {
@@ -26,17 +31,25 @@ specs = {
 
         "file": "<example.csv>",
         #"args": [],
+        #"rows_per_load": 0,
+        #"file_workers": 1,
+        #"batch_size": BATCH_SIZE,
+        #"checkpoint_batches": CHECKPOINT_BATCHES,
         #"force": False,
         #"encoding": ENCODING,
         #"csv_dialect": CSV_DIALECT,
         #"csv_delimiter": CSV_DELIMITER,
+        #"csv_engine": CSV_ENGINE,
         #"skip_lines": 0,
         #"text_lines": False,
 
         #"source": SOURCE,
         #"setup": [],
+        #"staging": {"table": "<staging_table>", "columns": {"code": "int", "name": "varchar(50)"}},
         #"insert_data": lambda row: (row[2], row[3]),
+        #"insert_data_batch": False,
         #"insert_actions": "insert into <table_name> (code, name) values (?, ?)",
+        #"skip_bad_rows": False,
         #"validate_actions": [],
         #"process_actions": [],
         #"upset": [],
@@ -9,6 +9,7 @@ from sources import sources
 DEBUGGING = True
 LOGGING = True
 PARALLEL_WORKERS = 2
+#LONGEST_FIRST = False
 
 OUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'out')
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
@@ -9,7 +9,11 @@ from datetime import date, datetime, timedelta
 from math import ceil
 import re
 import sqlite3
+import zlib
+import json
+import queue
 import threading
+from time import perf_counter
 
 from jinja2 import (
     Template,
@@ -82,6 +86,8 @@ if not os.path.isdir(OUT_DIR):
 OUT_FILE = os.path.join(OUT_DIR, '{}.html')
 
 PARALLEL_WORKERS = min(getattr(cfg, 'PARALLEL_WORKERS', 1), 8)
+# run specs longest first, by their durations in previous runs
+LONGEST_FIRST = getattr(cfg, 'LONGEST_FIRST', False)
 
 DEBUGGING = getattr(cfg, 'DEBUGGING', False)
 LOGGING = getattr(cfg, 'LOGGING', DEBUGGING)
@@ -116,10 +122,20 @@ DATE_FORMAT = getattr(cfg, 'DATE_FORMAT', '%Y-%m-%d')
 DDIFF_KEEP = False
 # number of rows to fetch with one fetch
 ONE_FETCH_ROWS = 5000
-# number of fetched rows at which we go no futher
-MAX_FETCH_ROWS = 1000000
+# number of fetched rows at which we go no futher, if any
+MAX_ROWS = getattr(cfg, 'MAX_ROWS', None)
 # number of mismatchs at which we go no deeper
 MAX_DISCREPANCIES = 1000
+# diff query results with SQL in ddiff_ table ("sql"), in memory ("hash") or by merging them ("merge")
+DIFF_ENGINE = getattr(cfg, 'DIFF_ENGINE', 'sql')
+# fetch DB1 and DB2 query results concurrently on separate connections
+PARALLEL_FETCH = getattr(cfg, 'PARALLEL_FETCH', True)
+# max number of fetched chunks of rows waiting to be inserted into ddiff_ table
+FETCH_QUEUE_SIZE = 4
+# number of rows in differing buckets at which we go no deeper
+MAX_BUCKET_ROWS = ONE_FETCH_ROWS
+# durations of specs in previous runs
+STAT_FILE = os.path.join(TEMP_DIR, f".ddiff.{CFG_MODULE}.json")
 
 DDIFF_SETUP = {
     "mssql": [
@@ -354,12 +370,11 @@ if DDIFF_SOURCE is None or DDIFF_SOURCE['database'] == 'sqlite':
     DDIFF_SOURCE = SQLITE_SOURCE
 DDIFF_SOURCE['setup'] = DDIFF_SETUP[DDIFF_SOURCE['database']] + DDIFF_SOURCE.get('setup', [])
 
-# TODO limit number for rows to MAX_FETCH_ROWS
 INSERT_SELECT = """
 insert into ddiff_ (
     cfg,spec,run,source,{% for col in c['select_list'] %}c{{loop.index}}{{"," if not loop.last}}{% endfor %})
 select
-{%- if database == 'mssql' %}
+{%- if database == 'mssql' %}{% if max_rows %} top {{max_rows}}{% endif %}
     ?,?,?,?,{% for col in c['select_list'] %}{{col}}{{"," if not loop.last}}{% endfor %}
 {%- elif database == 'mysql' %}
     %s,%s,%s,%s,{% for col in c['select_list'] %}{{col}}{{"," if not loop.last}}{% endfor %}
@@ -371,6 +386,11 @@ select
     ?,?,?,?,{% for col in c['select_list'] %}{{col}}{{"," if not loop.last}}{% endfor %}
 {%- endif %}
 from ({{q}}) t
+{%- if max_rows and database == 'oracle' %}
+where rownum <= {{max_rows}}
+{%- elif max_rows and database != 'mssql' %}
+limit {{max_rows}}
+{%- endif %}
 """
 INSERT_VALUES = """
 insert into ddiff_ (
@@ -541,6 +561,99 @@ where cfg = '{{cfg}}' and spec = '{{spec}}' and run = {{run[0]}}
 order by {% for i in pk_nums %}{{loop.index}}{{"," if not loop.last}}{% endfor %}
 """
 
+BUCKET_HASH = """
+{%- macro text(cols) -%}
+{%- for col in cols -%}
+{%- if database == 'mysql' -%}
+coalesce(concat('v', t.`{{col}}`), 'n'){{", '|', " if not loop.last}}
+{%- elif database == 'oracle' -%}
+nvl2(t."{{col}}", 'v' || t."{{col}}", 'n'){{" || '|' || " if not loop.last}}
+{%- elif database == 'mssql' -%}
+coalesce('v' + cast(t."{{col}}" as nvarchar(max)), 'n'){{" + '|' + " if not loop.last}}
+{%- elif database == 'postgresql' -%}
+coalesce('v' || t."{{col}}"::text, 'n'){{" || '|' || " if not loop.last}}
+{%- else -%}
+coalesce('v' || t."{{col}}", 'n'){{" || '|' || " if not loop.last}}
+{%- endif -%}
+{%- endfor -%}
+{%- endmacro -%}
+{%- macro hash(cols) -%}
+{%- if database == 'mysql' -%}
+crc32(concat({{text(cols)}}))
+{%- elif database == 'oracle' -%}
+ora_hash({{text(cols)}})
+{%- elif database == 'mssql' -%}
+(cast(binary_checksum({{text(cols)}}) as bigint) + 2147483648)
+{%- elif database == 'postgresql' -%}
+('x' || substr(md5({{text(cols)}}), 1, 8))::bit(32)::bigint
+{%- else -%}
+ddiff_crc32({{text(cols)}})
+{%- endif -%}
+{%- endmacro -%}
+{%- macro bucket(cols, m) -%}
+{%- if database == 'oracle' -%}
+mod({{hash(cols)}}, {{m}})
+{%- else -%}
+{{hash(cols)}} % {{m}}
+{%- endif -%}
+{%- endmacro -%}
+{%- macro null_pk(cols) -%}
+{%- for col in cols -%}
+{%- if database == 'mysql' -%}
+t.`{{col}}` is null{{" or " if not loop.last}}
+{%- else -%}
+t."{{col}}" is null{{" or " if not loop.last}}
+{%- endif -%}
+{%- endfor -%}
+{%- endmacro -%}
+"""
+# rows with NULL in pk go to bucket -1, which is always pulled,
+# as the row engines report such rows whatever their checksum is
+SELECT_BUCKETS = BUCKET_HASH + """
+select b, count(*) cnt, sum(h) chk
+from (
+    select case when {{null_pk(pk)}} then -1 else {{bucket(pk, m)}} end b, {{hash(cols)}} h
+    from ({{q}}) t
+{%- if buckets %}
+    where {{bucket(pk, m_prev)}} in ({{buckets|join(',')}}){% if -1 in buckets %} or {{null_pk(pk)}}{% endif %}
+{%- endif %}
+) t
+group by b
+"""
+SELECT_BUCKET_ROWS = BUCKET_HASH + """
+select t.*
+from ({{q}}) t
+where {{bucket(pk, m)}} in ({{'{%'}} for row in argrows %}{{'{{'}}row[0]}}{{'{{'}}"," if not loop.last}}{{'{%'}} endfor %})
+{{'{%'}} if (-1,) in argrows %}or {{null_pk(pk)}}{{'{%'}} endif %}
+"""
+
+# query results ordered by pk text in binary (code point) order whatever
+# the collation of pk columns is, so both datasets can be merged in python
+SELECT_MERGE = """
+{%- macro key(col) -%}
+{%- if database == 'mysql' -%}
+cast(t.`{{col}}` as char character set utf8mb4) collate utf8mb4_bin
+{%- elif database == 'oracle' -%}
+to_char(t."{{col}}")
+{%- elif database == 'mssql' -%}
+cast(t."{{col}}" as nvarchar(4000)) collate Latin1_General_BIN2
+{%- elif database == 'postgresql' -%}
+t."{{col}}"::text collate "C"
+{%- else -%}
+cast(t."{{col}}" as text) collate binary
+{%- endif -%}
+{%- endmacro -%}
+select t.*{% for col in pk %}, {{key(col)}} ddiff_k{{loop.index}}{% endfor %}
+from ({{q}}) t
+order by {% for col in pk %}
+{%- if database == 'oracle' -%}
+nlssort({{key(col)}}, 'NLS_SORT=BINARY')
+{%- else -%}
+{{key(col)}}
+{%- endif -%}
+{{", " if not loop.last}}{% endfor %}
+"""
+
 #select_tpl = Template(SELECT_RESULTS)
 insert_select_tpl = Template(INSERT_SELECT)
 insert_tpl = Template(INSERT_VALUES)
@@ -548,6 +661,9 @@ delete_tpl = Template(DELETE_THE_SAME)
 select_tpl = Template(SELECT_THE_DIFF)
 select_diffs_tpl = Template(SELECT_DIFFS)
 insert_diffs_tpl = Template(INSERT_DIFFS)
+select_buckets_tpl = Template(SELECT_BUCKETS)
+select_bucket_rows_tpl = Template(SELECT_BUCKET_ROWS)
+select_merge_tpl = Template(SELECT_MERGE)
 
 SPEC_REPORT_TEMPLATE="""
 <!DOCTYPE html>
@@ -678,6 +794,40 @@ def exec_sql(con, sql):
         cur.close()
 
 
+def connect(source):
+    """
+    Connect to DB source and setup the session.
+    """
+    con_kwargs = source.get('con_kwargs', dict())
+    if source['database'] == 'sqlite':
+        # QueryFetcher fetches rows in a thread of its own
+        con_kwargs = dict(con_kwargs, check_same_thread=False)
+    con = \
+        source['lib'].connect(source['con_string'], **con_kwargs) \
+        if source.get('con_string') else \
+        source['lib'].connect(**con_kwargs)
+    if source['database'] == 'oracle':
+        oracle_setup(source['lib'], con)
+    if source['database'] == 'sqlite':
+        # hash function for bucket checksums
+        con.create_function('ddiff_crc32', 1, lambda s: zlib.crc32(s.encode()), deterministic=True)
+    if source.get('setup'):
+        logger.debug('-- setup')
+        exec_sql(con, source['setup'])
+    return con
+
+
+def disconnect(con, source):
+    """
+    Release the session and close connection to DB source.
+    """
+    if source.get('upset'):
+        logger.debug('-- upset')
+        exec_sql(con, source['upset'])
+        con.commit()
+    con.close()
+
+
 #def connection(src):
 #    if isinstance(src, str):
 #        source = sources[src]
@@ -754,11 +904,79 @@ def exec_sql(con, sql):
 #    return rowcount
 
 
+class QueryFetcher():
+    """
+    Fetch rows of a query executed on the spec's connection in a thread
+    of its own, so that DB1 and DB2 queries run concurrently in sessions
+    prepared by the spec's setups.
+    """
+    def __init__(self, con, source, name, query, max_rows=None):
+        self._queue = queue.Queue(maxsize=FETCH_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._fetch, args=(con, source, name, query, max_rows), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _fetch(self, con, source, name, query, max_rows):
+        try:
+            cur = server_cursor(con, source, name)
+            try:
+                cur.execute(query)
+                rowcount = 0
+                while not self._stop.is_set() and (not max_rows or rowcount < max_rows):
+                    rows = cur.fetchmany(ONE_FETCH_ROWS if not max_rows else min(ONE_FETCH_ROWS, max_rows - rowcount))
+                    if not rows:
+                        break
+                    rowcount += len(rows)
+                    self._put(rows)
+                self._put(None)
+            finally:
+                cur.close()
+        except Exception as e:
+            self._put(e)
+
+    def fetchmany(self):
+        if self._done:
+            return []
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        if item is None:
+            self._done = True
+            return []
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
 def pump_and_diff(con0, con1, con2, run, spec_name, spec, argrows):
+    """
+    Insert DB1 and DB2 query results into ddiff_ table and delete
+    equivalent rows from both datasets. Query results are fetched
+    ordered by pk in rounds of ONE_FETCH_ROWS rows of each dataset,
+    and equivalent rows are deleted after each round, so ddiff_ table
+    keeps little more than discrepancies. With parallel_fetch, DB1 and
+    DB2 queries are executed and fetched concurrently by QueryFetcher.
+    A dataset of the ddiff DB itself is copied at once by INSERT_SELECT,
+    so ddiff_ table keeps all of it until the other one is fetched.
+    """
+    cons = (con1, con2)
     cur0 = con0.cursor()
-    curs = (con1.cursor(), con2.cursor())
+    curs = [con1.cursor(), con2.cursor()]
     rowcounts = [0, 0]
     query_tpl = [None, None]
+    max_rows = spec.get('max_rows', MAX_ROWS)
+    parallel_fetch = spec.get('parallel_fetch', PARALLEL_FETCH)
 
     # to keep the query reasonably short we should split long argrows lists
     # into sereval shorter lists and execute several short selects/inserts
@@ -769,6 +987,7 @@ def pump_and_diff(con0, con1, con2, run, spec_name, spec, argrows):
 
     for part in range(parts):
         rowcounts = [0, 0]
+        queries = [None, None]
         for i in (0, 1):
             logger.debug("-- select %s dataset into ddiff_: %s time(s)", spec['sources'][i], parts)
             query = spec['queries'][i]
@@ -800,38 +1019,84 @@ def pump_and_diff(con0, con1, con2, run, spec_name, spec, argrows):
 
             if i == 0 and con0 is con1:
                 # ddiff DB is DB1
-                if not spec.get('insert_select_0'):
+                if argrows or not spec.get('insert_select_0'):
                     spec['insert_select_0'] = \
-                        insert_select_tpl.render(c=spec, database=DDIFF_SOURCE['database'], q=query)
+                        insert_select_tpl.render(c=spec, database=DDIFF_SOURCE['database'], q=query, max_rows=max_rows)
                     logger.debug('\n\n%s\n', spec['insert_select_0'].strip())
                 curs[i].execute(spec['insert_select_0'], (CFG_MODULE, spec_name, run[0], spec['sources'][i]))
-
-            if i == 1 and con0 is con2:
+                rowcounts[i] = max(curs[i].rowcount, 0)
+            elif i == 1 and con0 is con2:
                 # ddiff DB is DB2
-                if not spec.get('insert_select_1'):
+                if argrows or not spec.get('insert_select_1'):
                     spec['insert_select_1'] = \
-                        insert_select_tpl.render(c=spec, database=DDIFF_SOURCE['database'], q=query)
+                        insert_select_tpl.render(c=spec, database=DDIFF_SOURCE['database'], q=query, max_rows=max_rows)
                     logger.debug('\n\n%s\n', spec['insert_select_1'].strip())
                 curs[i].execute(spec['insert_select_1'], (CFG_MODULE, spec_name, run[0], spec['sources'][i]))
-
-            if (i == 0 and not (con0 is con1)) or (i == 1 and not (con0 is con2)):
+                rowcounts[i] = max(curs[i].rowcount, 0)
+            else:
                 # ddiff DB is neither DB1 nor DB2
-                logger.debug(f"{i} :\n\n{query.strip()}\n")
-                curs[i].execute(query)
-                logging.debug(f"{i} : {curs[i].description}")
-                logger.debug(f"{i} :\n\n{spec['insert'].strip()}\n")
-                while rowcounts[i] < MAX_FETCH_ROWS:
-                    res = curs[i].fetchmany(ONE_FETCH_ROWS)
-                    if not res:
-                        break
-                    rowcounts[i] += len(res)
-                    #logger.info(res)
-                    cur0.executemany(
-                        spec['insert'],
-                        # cx_Oracle requires list here - not a tuple, not a generator expr.
-                        # mssql-python's row has special Row type that cannot be added to tuple
-                        [(CFG_MODULE, spec_name, run[0], spec['sources'][i]) + (tuple(row) if not isinstance(row, tuple) else row) for row in res]
-                    )
+                queries[i] = f"select * from ({query}) t order by {', '.join(str(j) for j, col in spec['pk'])}"
+
+        # fetch both datasets in rounds, but one after another if DB1 and DB2
+        # share the connection that cannot have two active cursors
+        fetched = [i for i in (0, 1) if queries[i]]
+        if len(fetched) == 2 and con1 is con2 and sources[spec['sources'][0]]['database'] in ('mysql', 'mssql'):
+            streams = [[0], [1]]
+        else:
+            streams = [fetched]
+        # a query is fetched in a thread of its own only on a connection
+        # no other cursor is busy with meanwhile (sqlite user functions
+        # such as ddiff_crc32 would deadlock there)
+        threaded = [
+            parallel_fetch and cons[i] is not con0 and not (len(fetched) == 2 and con1 is con2)
+            for i in (0, 1)
+        ]
+        fetchers = [None, None]
+        try:
+            for stream in streams:
+                for i in stream:
+                    logger.debug(f"{i} :\n\n{queries[i].strip()}\n")
+                    if threaded[i]:
+                        fetchers[i] = QueryFetcher(cons[i], sources[spec['sources'][i]], f"ddiff{i}", queries[i], max_rows)
+                    else:
+                        curs[i].close()
+                        curs[i] = server_cursor(cons[i], sources[spec['sources'][i]], f"ddiff{i}")
+                        curs[i].execute(queries[i])
+                        logging.debug(f"{i} : {curs[i].description}")
+                    logger.debug(f"{i} :\n\n{spec['insert'].strip()}\n")
+                while stream:
+                    for i in list(stream):
+                        if threaded[i]:
+                            res = fetchers[i].fetchmany()
+                        else:
+                            res = curs[i].fetchmany(ONE_FETCH_ROWS if not max_rows else min(ONE_FETCH_ROWS, max_rows - rowcounts[i]))
+                        if not res:
+                            stream.remove(i)
+                            if fetchers[i]:
+                                fetchers[i].close()
+                            continue
+                        rowcounts[i] += len(res)
+                        if max_rows and rowcounts[i] >= max_rows:
+                            logger.debug(f"-- fetched max_rows {max_rows} of {spec['sources'][i]} dataset")
+                            stream.remove(i)
+                            if fetchers[i]:
+                                # release the connection for the next stream
+                                fetchers[i].close()
+                        #logger.info(res)
+                        cur0.executemany(
+                            spec['insert'],
+                            # cx_Oracle requires list here - not a tuple, not a generator expr.
+                            # mssql-python's row has special Row type that cannot be added to tuple
+                            [(CFG_MODULE, spec_name, run[0], spec['sources'][i]) + (tuple(row) if not isinstance(row, tuple) else row) for row in res]
+                        )
+                    # delete equivalent rows of the round from both datasets
+                    cur0.execute(spec['delete'])
+                    # these commits prevent deadlocks when con0 is MySQL or MSSQL
+                    con0.commit()
+        finally:
+            for fetcher in fetchers:
+                if fetcher:
+                    fetcher.close()
         # these commits prevent deadlocks when con0 is MySQL or MSSQL
         con0.commit()
 
@@ -861,6 +1126,331 @@ def pump_and_diff(con0, con1, con2, run, spec_name, spec, argrows):
     return rowcounts
 
 
+def to_text(val):
+    """
+    Represent value as text the way it is stored in ddiff_ table.
+    """
+    if val is None or isinstance(val, str):
+        return val
+    if isinstance(val, (float, dec.Decimal)):
+        s = str(val)
+        return s.rstrip('0').rstrip('.') if '.' in s else '0' if val == 0 else s
+    if isinstance(val, date):
+        return val.isoformat()
+    if isinstance(val, bool):
+        return str(int(val))
+    return str(val)
+
+
+def hash_diff(con1, con2, run, spec_name, spec, argrows):
+    """
+    Find discrepancies between DB1 and DB2 query results in memory,
+    without ddiff_ table: rows of DB1 are hashed by pk, then rows of DB2
+    probe them. Return row counts, discrepancies and their titles
+    the same as SELECT_THE_DIFF does.
+    """
+    curs = (con1.cursor(), con2.cursor())
+    rowcounts = [0, 0]
+    query_tpl = [None, None]
+    op = spec.get('op', '=')
+
+    # DB1 and DB2 rows by pk, but for pk of rows found in both
+    max_rows = spec.get('max_rows', MAX_ROWS)
+    rows = ({}, {})
+    same = set()
+    # rows with NULL in pk never match, like in SQL join
+    nulls = ([], [])
+
+    # to keep the query reasonably short we should split long argrows lists
+    # into sereval shorter lists and execute several short selects
+    if argrows:
+        parts = ceil(len(argrows) / 200)
+    else:
+        parts = 1
+
+    for part in range(parts):
+        rowcounts = [0, 0]
+        for i in (0, 1):
+            query = spec['queries'][i]
+            if argrows:
+                if query_tpl[i] is None:
+                    query_tpl[i] = Template(spec['queries'][i])
+                query = query_tpl[i].render(argrows=argrows[part*200:part*200+200])
+            logger.debug(f"{i} :\n\n{query.strip()}\n")
+            curs[i].execute(query)
+
+            if spec.get('cols') is None:
+                spec['select_list'] = [d[0].lower() for d in curs[i].description]
+                spec['cols'] = [(i + 1, d[0].lower()) for i, d in enumerate(curs[i].description) if d[0].lower() not in spec['pk']]
+                spec['pk'] = [(i + 1, d[0].lower()) for i, d in enumerate(curs[i].description) if d[0].lower() in spec['pk']]
+            pk_index = [j - 1 for j, col in spec['pk']]
+            cols_index = [j - 1 for j, col in spec['cols']]
+
+            while not max_rows or rowcounts[i] < max_rows:
+                res = curs[i].fetchmany(ONE_FETCH_ROWS if not max_rows else min(ONE_FETCH_ROWS, max_rows - rowcounts[i]))
+                if not res:
+                    break
+                rowcounts[i] += len(res)
+                for row in res:
+                    row = [to_text(val) for val in row]
+                    pk = tuple(row[j] for j in pk_index)
+                    cols = tuple(row[j] for j in cols_index)
+                    if None in pk:
+                        nulls[i].append((pk, cols))
+                    elif pk in same:
+                        pass
+                    elif i == 1 and cols in rows[0].get(pk, ()):
+                        # delete equivalent rows from both datasets
+                        same.add(pk)
+                        rows[0].pop(pk)
+                        rows[1].pop(pk, None)
+                    else:
+                        rows[i].setdefault(pk, []).append(cols)
+
+        # limit max number of discrepancies
+        diffcount = (sum(map(len, rows[0].values())) + sum(map(len, rows[1].values())) + len(nulls[0]) + len(nulls[1])) // 2
+        if diffcount > MAX_DISCREPANCIES * (100 if args.one or args.two else 1):
+            logger.debug(f"-- found {diffcount} discrepancies; go no further")
+            break
+
+    curs[0].close()
+    curs[1].close()
+
+    # left join one dataset to another one
+    diffs = set()
+    for i in ((0,) if op == '<' else (1,) if op == '>' else (0, 1)):
+        for pk, cols in [(pk, cols) for pk, cols_list in rows[i].items() for cols in cols_list] + nulls[i]:
+            for other in rows[1 - i].get(pk) or [None]:
+                cols1, cols2 = (cols, other) if i == 0 else (other, cols)
+                diffs.add(pk + tuple(
+                    val
+                    for j in range(len(cols))
+                    for val in (cols1[j] if cols1 else None, cols2[j] if cols2 else None)
+                ))
+    diffs = sorted(diffs, key=lambda row: tuple((val is not None, val) for val in row))
+    titles = [col for j, col in spec['pk']] + [f"DB{k} {col}" for j, col in spec['cols'] for k in (1, 2)]
+
+    return rowcounts, diffs, titles
+
+
+def server_cursor(con, source, name):
+    """
+    Open cursor that streams rows from DB server instead of buffering
+    the whole result set at client side.
+    """
+    if source['database'] == 'postgresql':
+        # psycopg named cursor is a server-side cursor
+        return con.cursor(name=name)
+    else:
+        # mysql.connector cursors are unbuffered by default;
+        # oracledb, mssql_python and sqlite3 cursors fetch rows by arraysize anyway
+        return con.cursor()
+
+
+def merge_diff(con1, con2, run, spec_name, spec, argrows):
+    """
+    Find discrepancies between DB1 and DB2 query results by merging
+    them ordered by pk, without ddiff_ table and without keeping query
+    results in memory. Both queries are ordered by pk text in binary order
+    and merged by that text, so pk values equal in DB1 and DB2 must have
+    the same text. Return row counts, discrepancies and their titles the
+    same as SELECT_THE_DIFF does.
+    """
+    cons = (con1, con2)
+    databases = [sources[source]['database'] for source in spec['sources']]
+    rowcounts = [0, 0]
+    query_tpl = [None, None]
+    names = [None, None]
+    op = spec.get('op', '=')
+    max_diffs = MAX_DISCREPANCIES * (100 if args.one or args.two else 1)
+    max_rows = spec.get('max_rows', MAX_ROWS)
+    diffs = set()
+
+    def groups(cur, i):
+        # yield (pk key, pk text, list of cols texts) for each pk of
+        # ordered query results; rows with NULL in pk are yielded one by one
+        key = None
+        while not max_rows or rowcounts[i] < max_rows:
+            res = cur.fetchmany(ONE_FETCH_ROWS if not max_rows else min(ONE_FETCH_ROWS, max_rows - rowcounts[i]))
+            if not res:
+                break
+            rowcounts[i] += len(res)
+            for row in res:
+                k = tuple(row[j] for j in key_index)
+                cols = tuple(to_text(row[j]) for j in cols_index)
+                if None in k:
+                    yield None, tuple(to_text(row[j]) for j in pk_index), [cols]
+                elif k == key:
+                    cols_list.append(cols)
+                else:
+                    if key is not None:
+                        if not key < k:
+                            raise ValueError(f"DB{i + 1} query results are not ordered by pk in binary order: {key} goes before {k}")
+                        yield key, pk, cols_list
+                    key, pk, cols_list = k, tuple(to_text(row[j]) for j in pk_index), [cols]
+        if key is not None:
+            yield key, pk, cols_list
+
+    def join(pk, cols1_list, cols2_list):
+        # left join one dataset to another one
+        pairs = []
+        if op in ('<', '='):
+            pairs += [(cols1, cols2) for cols1 in cols1_list for cols2 in cols2_list or [None]]
+        if op in ('>', '='):
+            pairs += [(cols1, cols2) for cols2 in cols2_list for cols1 in cols1_list or [None]]
+        for cols1, cols2 in pairs:
+            diffs.add(pk + tuple(
+                val
+                for j in range(len(cols_index))
+                for val in (cols1[j] if cols1 else None, cols2[j] if cols2 else None)
+            ))
+
+    # to keep the query reasonably short we should split long argrows lists
+    # into sereval shorter lists and execute several short selects
+    if argrows:
+        parts = ceil(len(argrows) / 200)
+    else:
+        parts = 1
+
+    for part in range(parts):
+        rowcounts = [0, 0]
+        curs = [None, None]
+        for i in (0, 1):
+            query = spec['queries'][i]
+            if argrows:
+                if query_tpl[i] is None:
+                    query_tpl[i] = Template(spec['queries'][i])
+                query = query_tpl[i].render(argrows=argrows[part*200:part*200+200])
+
+            if names[i] is None:
+                # get query metadata (description) to order query results by pk
+                cur = cons[i].cursor()
+                cur.execute('select * from (' + query + ') t where 1 != 1')
+                cur.fetchall()
+                names[i] = [d[0] for d in cur.description]
+                cur.close()
+            if spec.get('cols') is None:
+                spec['select_list'] = [name.lower() for name in names[i]]
+                spec['cols'] = [(j + 1, name.lower()) for j, name in enumerate(names[i]) if name.lower() not in spec['pk']]
+                spec['pk'] = [(j + 1, name.lower()) for j, name in enumerate(names[i]) if name.lower() in spec['pk']]
+            pk_index = [j - 1 for j, col in spec['pk']]
+            cols_index = [j - 1 for j, col in spec['cols']]
+            key_index = [len(names[i]) + n for n in range(len(pk_index))]
+
+            query = \
+                select_merge_tpl.render(
+                    database=databases[i],
+                    q=query,
+                    pk=[names[i][j] for j in pk_index]
+                )
+            logger.debug(f"{i} :\n\n{query.strip()}\n")
+            curs[i] = server_cursor(cons[i], sources[spec['sources'][i]], f"ddiff{i}")
+            curs[i].execute(query)
+
+        its = (groups(curs[0], 0), groups(curs[1], 1))
+        g = [next(its[0], None), next(its[1], None)]
+        while (g[0] or g[1]) and len(diffs) <= max_diffs:
+            if g[0] and (g[0][0] is None or not g[1] or g[1][0] is not None and g[0][0] < g[1][0]):
+                # pk is found in DB1 only
+                join(g[0][1], g[0][2], [])
+                g[0] = next(its[0], None)
+            elif g[1] and (g[1][0] is None or not g[0] or g[1][0] < g[0][0]):
+                # pk is found in DB2 only
+                join(g[1][1], [], g[1][2])
+                g[1] = next(its[1], None)
+            else:
+                # skip equivalent rows of both datasets
+                if not set(g[0][2]) & set(g[1][2]):
+                    join(g[0][1], g[0][2], g[1][2])
+                g = [next(its[0], None), next(its[1], None)]
+
+        curs[0].close()
+        curs[1].close()
+
+        # limit max number of discrepancies
+        if len(diffs) > max_diffs:
+            logger.debug(f"-- found {len(diffs)} discrepancies; go no further")
+            break
+
+    diffs = sorted(diffs, key=lambda row: tuple((val is not None, val) for val in row))
+    titles = [col for j, col in spec['pk']] + [f"DB{k} {col}" for j, col in spec['cols'] for k in (1, 2)]
+
+    return rowcounts, diffs, titles
+
+
+def bucket_diff(con1, con2, spec_name, spec):
+    """
+    Compare row counts and checksums of DB1 and DB2 query results,
+    computed by DB1 and DB2 servers per bucket of pk hash, and drill down
+    into the buckets that differ. Return row counts, queries that select
+    rows of the differing buckets and the buckets as argrows for them.
+    """
+    cons = (con1, con2)
+    databases = [sources[source]['database'] for source in spec['sources']]
+    assert databases[0] == databases[1], f"Buckets of spec {spec_name} require DB1 and DB2 of the same database"
+    n = spec['buckets']
+    rowcounts = [0, 0]
+    queries = [None, None]
+    names = [None, None]
+
+    for i in (0, 1):
+        # get query metadata (description) to build checksum queries
+        cur = cons[i].cursor()
+        cur.execute('select * from (' + spec['queries'][i] + ') t where 1 != 1')
+        cur.fetchall()
+        names[i] = [d[0] for d in cur.description]
+        cur.close()
+
+    m, buckets = 1, None
+    while True:
+        m_prev, m = m, m * n
+        sums = ({}, {})
+        for i in (0, 1):
+            select = \
+                select_buckets_tpl.render(
+                    database=databases[i],
+                    q=spec['queries'][i],
+                    pk=[name for name in names[i] if name.lower() in spec['pk']],
+                    cols=names[i],
+                    m=m,
+                    m_prev=m_prev,
+                    buckets=buckets
+                )
+            logger.debug(f"{i} :\n\n{select.strip()}\n")
+            cur = cons[i].cursor()
+            cur.execute(select)
+            for b, cnt, chk in cur.fetchall():
+                sums[i][int(b)] = (int(cnt), int(chk))
+            cur.close()
+            if buckets is None:
+                rowcounts[i] = sum(cnt for cnt, chk in sums[i].values())
+        # bucket -1 of rows with NULL in pk differs whatever its checksums are
+        diff = sorted(b for b in sums[0].keys() | sums[1].keys() if b == -1 or sums[0].get(b) != sums[1].get(b))
+        rows = sum(max(sums[0].get(b, (0, 0))[0], sums[1].get(b, (0, 0))[0]) for b in diff)
+        logger.debug(f"-- {len(diff)} of {len(sums[0].keys() | sums[1].keys())} buckets by {m} differ, {rows} rows")
+        buckets = diff
+        # go deeper while few buckets differ and they have too many rows
+        if (
+            not diff
+            or rows <= MAX_BUCKET_ROWS
+            or len(diff) * 2 > len(sums[0].keys() | sums[1].keys())
+            or len(diff) > 1000
+            or m * n > 2**32
+        ):
+            break
+
+    for i in (0, 1):
+        queries[i] = \
+            select_bucket_rows_tpl.render(
+                database=databases[i],
+                q=spec['queries'][i],
+                pk=[name for name in names[i] if name.lower() in spec['pk']],
+                m=m
+            )
+
+    return rowcounts, queries, [(b,) for b in buckets]
+
+
 def process_spec(con0, con1, con2, run, spec_name, spec, argrows, lvl=1):
     """
     Process spec from config-file.
@@ -880,6 +1470,12 @@ def process_spec(con0, con1, con2, run, spec_name, spec, argrows, lvl=1):
             #and sources.get(spec['sources'][1])
             and spec.get('op', '=').__class__ == str
             and spec.get('op', '=') in ('<', '>', '=')
+            and spec.get('engine', DIFF_ENGINE) in ('sql', 'hash', 'merge')
+            and spec.get('buckets', 2).__class__ == int
+            and spec.get('buckets', 2) > 1
+            and spec.get('max_rows', 1).__class__ == int
+            and spec.get('max_rows', 1) > 0
+            and spec.get('parallel_fetch', True).__class__ == bool
             ), f"Bad spec {spec_name}"
 
         if spec.get('cols') is None:
@@ -912,26 +1508,49 @@ def process_spec(con0, con1, con2, run, spec_name, spec, argrows, lvl=1):
             # Get DB2 query results and insert them into ddiff_ table.
             #rowcount2 = pump(run, spec_name, spec, con0, con2, argrows, 1)
 
-            rowcount1, rowcount2 = pump_and_diff(con0, con1, con2, run, spec_name, spec, argrows)
+            if spec.get('buckets') and not argrows:
+                # Compare checksums of 1st and 2nd query results by buckets
+                # and get differences of the differing buckets only.
+                logger.debug(f"-- compare bucket checksums, level {lvl}")
+                (rowcount1, rowcount2), spec['queries'], argrows = bucket_diff(con1, con2, spec_name, spec)
+            buckets_match = spec.get('buckets') and not argrows
+
+            if buckets_match:
+                # All the buckets match.
+                cur0 = con0.cursor()
+            elif spec.get('engine', DIFF_ENGINE) == 'hash':
+                # Get differences between 1st and 2nd query results in memory.
+                logger.debug(f"-- hash discrepancies, level {lvl}")
+                (rowcount1, rowcount2), rows, titles = hash_diff(con1, con2, run, spec_name, spec, argrows)
+                cur0 = con0.cursor()
+            elif spec.get('engine', DIFF_ENGINE) == 'merge':
+                # Get differences between 1st and 2nd query results ordered by pk.
+                logger.debug(f"-- merge discrepancies, level {lvl}")
+                (rowcount1, rowcount2), rows, titles = merge_diff(con1, con2, run, spec_name, spec, argrows)
+                cur0 = con0.cursor()
+            else:
+                rowcount1, rowcount2 = pump_and_diff(con0, con1, con2, run, spec_name, spec, argrows)
 
-            if MAX_FETCH_ROWS <= max(rowcount1, rowcount2):
-                specs[spec_name]['warnings'].append(f"DB1: {rowcount1} rows, DB2: {rowcount2} rows.")
+            if not buckets_match and spec.get('max_rows', MAX_ROWS) and spec.get('max_rows', MAX_ROWS) <= max(rowcount1, rowcount2):
+                specs[spec_name]['warnings'].append(f"Fetched max_rows {spec.get('max_rows', MAX_ROWS)}; DB1: {rowcount1} rows, DB2: {rowcount2} rows.")
 
-            # Get differences between 1st and 2nd query results.
-            select = \
-                select_tpl.render(
-                    cfg=CFG_MODULE,
-                    spec=spec_name,
-                    run=run,
-                    c=spec,
-                    database=DDIFF_SOURCE['database'],
-                    op=spec.get('op', '=')
-                )
-            logger.debug(f"-- select discrepancies from ddiff_, level {lvl}")
-            logger.debug('\n\n%s\n', select.strip())
-            cur0 = con0.cursor()
-            cur0.execute(select)
-            rows = cur0.fetchall()
+            if spec.get('engine', DIFF_ENGINE) == 'sql' and not buckets_match:
+                # Get differences between 1st and 2nd query results.
+                select = \
+                    select_tpl.render(
+                        cfg=CFG_MODULE,
+                        spec=spec_name,
+                        run=run,
+                        c=spec,
+                        database=DDIFF_SOURCE['database'],
+                        op=spec.get('op', '=')
+                    )
+                logger.debug(f"-- select discrepancies from ddiff_, level {lvl}")
+                logger.debug('\n\n%s\n', select.strip())
+                cur0 = con0.cursor()
+                cur0.execute(select)
+                rows = cur0.fetchall()
+                titles = [x[0] for x in cur0.description]
 
             if rows:
                 if spec.get(spec_name) and len(rows) <= MAX_DISCREPANCIES * (100 if args.one or args.two else 1):
@@ -943,11 +1562,15 @@ def process_spec(con0, con1, con2, run, spec_name, spec, argrows, lvl=1):
                         spec[spec_name]['sources'] = spec['sources']
                     if spec.get('op') and not spec[spec_name].get('op'):
                         spec[spec_name]['op'] = spec['op']
+                    if spec.get('engine') and not spec[spec_name].get('engine'):
+                        spec[spec_name]['engine'] = spec['engine']
+                    if spec.get('max_rows') and not spec[spec_name].get('max_rows'):
+                        spec[spec_name]['max_rows'] = spec['max_rows']
+                    if 'parallel_fetch' in spec and 'parallel_fetch' not in spec[spec_name]:
+                        spec[spec_name]['parallel_fetch'] = spec['parallel_fetch']
                     logger.info(f"Found {len(rows)} discrepancies at level {lvl}.")
                     process_spec(con0, con1, con2, run, spec_name, spec[spec_name], rows, lvl+1)
                 else:
-                    titles=(x[0] for x in cur0.description)
-
                     if args.one or args.two:
                         # Store the found discrepancies in ddiff_diffs_ table.
                         insert_diffs = insert_diffs_tpl.render(c=spec, database=DDIFF_SOURCE['database'])
@@ -1120,7 +1743,7 @@ class ReturnValueThread(threading.Thread):
         return self.result
 
 
-def worker(worker_number, list_of_arg_tuples):
+def worker(worker_number, todo):
     error_count = 0
     #constr_to_source = dict()
     sources_by_id = dict()
@@ -1146,7 +1769,12 @@ def worker(worker_number, list_of_arg_tuples):
         exec_sql(con0, source['setup'])
         con0.commit()
 
-    for arg_tuple in list_of_arg_tuples:
+    while True:
+        # take the next spec as soon as this worker is free
+        try:
+            arg_tuple = todo.get_nowait()
+        except queue.Empty:
+            break
         run, spec_name, spec, argrows = arg_tuple
 
         # get worker connections for the spec
@@ -1157,33 +1785,22 @@ def worker(worker_number, list_of_arg_tuples):
             sources_by_id[id(source)] = source
             if not connections.get(id(source)): #constr):
                 #connections[constr] = \
-                connections[id(source)] = \
-                    source['lib'].connect(source['con_string'], **source.get('con_kwargs', dict())) \
-                    if source.get('con_string') else \
-                    source['lib'].connect(**source['con_kwargs'])
-                if source['database'] == 'oracle':
-                    oracle_setup(source['lib'], connections[id(source)])
-                if source.get('setup'):
-                    logger.debug(f"-- \"{id(source)}\" setup")
-                    exec_sql(connections[id(source)], source['setup'])
+                connections[id(source)] = connect(source)
             if source_no == 0:
                 con1 = connections[id(source)]
             if source_no == 1:
                 con2 = connections[id(source)]
 
         # execute the spec
+        started = perf_counter()
         error_count += process_spec(con0, con1, con2, run, spec_name, spec, argrows)
+        spec['duration'] = perf_counter() - started
 
     logging.debug(f"{worker_number=}, {connections=}")
 
     # shutdown all worker connections, including ddiff one (con0)
     for source_id, con in connections.items():
-        source = sources_by_id[source_id]
-        if source.get('upset'):
-            logger.debug(f"-- \"{id(source)}\" upset")
-            exec_sql(con, source['upset'])
-            con.commit()
-        con.close()
+        disconnect(con, sources_by_id[source_id])
 
     if DDIFF_SOURCE['database'] == 'sqlite' and args.two:
         os.remove(sqlite_db)
@@ -1202,6 +1819,12 @@ def main():
     ]
     logger.info(f"run {run[0]} with {PARALLEL_WORKERS} thread(s)")
 
+    if os.path.isfile(STAT_FILE):
+        with open(STAT_FILE, encoding='UTF-8') as f:
+            stat = json.load(f)
+    else:
+        stat = dict()
+
     error_count = 0
     todo = []
     for spec_name, spec in specs.items():
@@ -1238,15 +1861,29 @@ def main():
             todo.append((run, spec_name, spec, spec.get('argrows', [])))
             #error_count += process_spec(run, spec_name, spec, con0, spec.get('argrows', []))
 
+    # let worker threads take specs from the shared queue
+    if LONGEST_FIRST:
+        todo.sort(key=lambda arg_tuple: stat.get(arg_tuple[1], {}).get('duration', float('inf')), reverse=True)
+    todo_queue = queue.Queue()
+    for arg_tuple in todo:
+        todo_queue.put(arg_tuple)
+
     # create and start worker threads
     threads = []
     for i in range(PARALLEL_WORKERS):
-        threads.append(ReturnValueThread(target=worker, args=(i, todo[i::PARALLEL_WORKERS])))
+        threads.append(ReturnValueThread(target=worker, args=(i, todo_queue)))
         threads[-1].start()
     # wait for all worker threads to terminate
     for thread in threads:
         error_count += thread.join()
 
+    for spec_name, spec in specs.items():
+        if spec.get('duration') is not None:
+            stat[spec_name] = dict(stat.get(spec_name, {}), duration=spec['duration'])
+    stat = {k: v for k, v in stat.items() if k in specs}
+    with open(STAT_FILE, 'w', encoding='UTF-8') as f:
+        f.write(json.dumps(stat))
+
     if not args.one:
         run_results = [
             (spec['safe_name'], spec.get('result', -1), spec.get('warnings'), spec['sources'][0], spec['sources'][1], spec.get('doc'), spec.get('timing'))
@@ -5,6 +5,7 @@ import sys
 import locale
 import re
 import csv
+import io
 import json
 import glob
 import argparse
@@ -22,6 +23,8 @@ from jinja2 import (
     select_autoescape
 )
 
+from dio import naive_csv_reader, arrow_csv_reader, json_reader, CompressingFile
+
 
 VERSION = '0.4.0'
 
@@ -135,9 +138,17 @@ DATE_FORMAT = getattr(cfg, 'DATE_FORMAT', '%Y-%m-%d')
 
 CSV_DIALECT = getattr(cfg, 'CSV_DIALECT', 'excel')
 CSV_DELIMITER = getattr(cfg, 'CSV_DELIMITER', None) or csv.get_dialect(CSV_DIALECT).delimiter
+# CSV parser: "python" for csv.reader or "pyarrow" to parse by large blocks
+CSV_ENGINE = getattr(cfg, 'CSV_ENGINE', 'python')
+# number of bytes parsed at once by "pyarrow" CSV engine
+CSV_BLOCK_SIZE = 4 * 1024 * 1024
+# number of rows passed at once to batch transformer unless limited by rows_per_file
+ONE_BATCH_ROWS = 1000
 
 STAT_FILE = os.path.join(TEMP_DIR, f".{CFG_MODULE}.json")
 GLUE_FILES = getattr(cfg, 'GLUE_FILES', True)
+# number of characters to read from JSON file at once
+JSON_CHUNK_SIZE = 1024 * 1024
 
 env = Environment(
     loader=FileSystemLoader([TEMPLATES_DIR, CFG_DIR]),
@@ -193,15 +204,13 @@ class RowsReader():
         self._file = None
         self._row_num = 0
         self._row_cnt = 0
+        self._transform = None
+        self._nested = None
+        self._pending = []
         self._run_num = int(datetime.now().strftime('%Y%m%d%H%M%S'))
         self._recent_files = None
         self._latest_mtime = 0
 
-    @staticmethod
-    def naive_csv_reader(file, delimiter):
-        for line in file:
-            yield line.split(delimiter)
-
     def files(self):
         if self._files:
             return self._files
@@ -223,12 +232,20 @@ class RowsReader():
         # normalize the spec
         if self._spec.get('transformer') and not isinstance(self._spec['transformer'], (list, tuple)):
             self._spec['transformer'] = [self._spec['transformer']]
+        if self._spec.get('transformer_batch', False):
+            self._transform = self._spec['transformer'][0]
+        else:
+            self._transform = self._transformer_caller(self._spec.get('transformer', [None])[0])
 
         # validate the spec
-        assert self._file_ext in ('csv', 'xlsx', 'json', 'zip') or self._spec.get('text_lines', False), \
+        assert self._file_ext in ('csv', 'xlsx', 'json', 'zip', 'gz', 'zst') or self._spec.get('text_lines', False), \
             f"Bad file extension \"{self._file_ext}\" in spec \"{self._spec_name}\""
         assert self._file_ext != 'json' or self._spec.get('transformer') or self._spec.get('text_lines', False), \
             f"Missing \"transformer\" in spec \"{self._spec_name}\""
+        assert self._spec.get('csv_engine', CSV_ENGINE) in ('python', 'pyarrow'), \
+            f"Bad \"csv_engine\" in spec \"{self._spec_name}\""
+        assert not self._spec.get('transformer_batch', False) or self._spec.get('transformer'), \
+            f"Missing \"transformer\" in spec \"{self._spec_name}\""
 
         # find files to read
         all_files = []
@@ -259,61 +276,86 @@ class RowsReader():
         logger.debug("%s - %s file(s) found: %s", self._spec_name, len(self._files), self._file_name)
         return self._files
 
-    def _open_reader(self, file_path):
-        _file = file_path
-        if self._file_ext == 'zip':
-            # unzip if zipfile contains the only file that meets the requirements
+    def _open_input(self, file_path):
+        """
+        Open input file as a binary stream; the only member of zip file and
+        gz or zst compressed file are decompressed while being read.
+        Return the stream, the name and the format of the data.
+        """
+        _file = os.path.basename(file_path)
+        file_ext = _file.rsplit('.', 1)[-1]
+        if file_ext == 'zip':
             import zipfile
-            with zipfile.ZipFile(_file) as zf:
+            with zipfile.ZipFile(file_path) as zf:
                 inner_file = zf.namelist()
                 assert len(inner_file) == 1, \
-                    f"More than 1 member in file {_file}"
+                    f"More than 1 member in file {file_path}"
                 inner_file = inner_file[0]
                 assert os.path.basename(inner_file) == inner_file, \
-                    f"Zip file member has path in file {_file}"
+                    f"Zip file member has path in file {file_path}"
                 inner_name, inner_ext = inner_file.rsplit('.', 1)
-                ifile_path, ifile_name = os.path.split(_file)
-                assert ifile_name.rsplit('.', 1)[0] in (inner_file, inner_name), \
-                    f"Zip file member name is inconsistent with file name {_file}"
+                assert _file.rsplit('.', 1)[0] in (inner_file, inner_name), \
+                    f"Zip file member name is inconsistent with file name {file_path}"
                 assert inner_ext in ('csv', 'json', 'xlsx') or self._spec.get('text_lines', False), \
-                    f"Zip file member has bad extension \"{inner_ext}\" in file {_file}"
+                    f"Zip file member has bad extension \"{inner_ext}\" in file {file_path}"
                 assert inner_ext != 'json' or self._spec.get('transformer'), \
                     f"Missing \"transformer\" in spec \"{self._spec_name}\""
-                zf.extractall(ifile_path)
-                extracted_file = os.path.join(ifile_path, inner_file)
-            if os.path.isfile(extracted_file):
-                if args.delete or self._spec.get('delete'):
-                    os.remove(_file)
-                _file = extracted_file
-                _format = inner_ext
-        else:
-            _format = self._file_ext
+                # the member stays readable after the archive is closed
+                return zf.open(inner_file), inner_file, inner_ext
+        elif file_ext in ('gz', 'zst'):
+            inner_file = _file.rsplit('.', 1)[0]
+            inner_ext = inner_file.rsplit('.', 1)[-1]
+            assert inner_ext in ('csv', 'json', 'xlsx') or self._spec.get('text_lines', False), \
+                f"Compressed file has bad extension \"{inner_ext}\" in file {file_path}"
+            assert inner_ext != 'json' or self._spec.get('transformer'), \
+                f"Missing \"transformer\" in spec \"{self._spec_name}\""
+            if file_ext == 'gz':
+                import gzip
+                return gzip.open(file_path, 'rb'), inner_file, inner_ext
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True), inner_file, inner_ext
+        return open(file_path, 'rb'), _file, file_ext
 
-        if self._spec.get('text_lines', False):
-            self._file = open(_file, 'r', encoding=self._spec.get('encoding', ENCODING))
-            self._reader = self._file
-        elif _format == 'csv':
-            self._file = open(_file, 'r', encoding=self._spec.get('encoding', ENCODING))
-            if self._spec.get('csv_dialect', CSV_DIALECT) == 'naive':
-                self._reader = \
-                    self.naive_csv_reader(
-                        self._file,
-                        delimiter=self._spec.get('csv_delimiter', CSV_DELIMITER)
-                    )
-            else:
-                self._reader = \
-                    csv.reader(
-                        self._file,
-                        dialect=self._spec.get('csv_dialect', CSV_DIALECT),
-                        delimiter=self._spec.get('csv_delimiter', CSV_DELIMITER)
-                    )
-        elif _format == 'xlsx':
-            self._file = load_workbook(filename=_file, read_only=True)
+    def _open_reader(self, file_path):
+        stream, _file, _format = self._open_input(file_path)
+
+        if _format == 'xlsx' and not self._spec.get('text_lines', False):
+            if _format != self._file_ext:
+                # openpyxl seeks all over the workbook, so decompress it into memory
+                with stream:
+                    stream = io.BytesIO(stream.read())
+            self._file = load_workbook(filename=stream, read_only=True)
             self._reader = self._file.worksheets[0].values
-        elif _format == 'json':
-            self._file = open(_file, 'r', encoding=self._spec.get('encoding', ENCODING))
-            self._reader = (row for row in json.load(self._file))
-            #assert isinstance(self._reader, list), f"Bad json file {_file}"
+        elif _format == 'csv' and self._spec.get('csv_engine', CSV_ENGINE) == 'pyarrow' and not self._spec.get('text_lines', False):
+            self._file = stream
+            self._reader = \
+                arrow_csv_reader(
+                    self._file,
+                    encoding=self._spec.get('encoding', ENCODING),
+                    dialect=self._spec.get('csv_dialect', CSV_DIALECT),
+                    delimiter=self._spec.get('csv_delimiter', CSV_DELIMITER),
+                    block_size=CSV_BLOCK_SIZE
+                )
+        else:
+            self._file = io.TextIOWrapper(stream, encoding=self._spec.get('encoding', ENCODING))
+            if self._spec.get('text_lines', False):
+                self._reader = self._file
+            elif _format == 'csv':
+                if self._spec.get('csv_dialect', CSV_DIALECT) == 'naive':
+                    self._reader = \
+                        naive_csv_reader(
+                            self._file,
+                            delimiter=self._spec.get('csv_delimiter', CSV_DELIMITER)
+                        )
+                else:
+                    self._reader = \
+                        csv.reader(
+                            self._file,
+                            dialect=self._spec.get('csv_dialect', CSV_DIALECT),
+                            delimiter=self._spec.get('csv_delimiter', CSV_DELIMITER)
+                        )
+            elif _format == 'json':
+                self._reader = json_reader(self._file, JSON_CHUNK_SIZE)
         logger.info(f"fi: {os.path.basename(_file)}")
 
     def _fetch_reader(self):
@@ -331,40 +373,78 @@ class RowsReader():
         if self._file:
             self._file.close()
             self._file = None
+            if self._file_ext in ('zip', 'gz', 'zst') and (args.delete or self._spec.get('delete')):
+                os.remove(self._files[self._files_index])
+
+    def _transformer_caller(self, func):
+        """
+        Resolve calling convention of transformer function once per spec.
+        Return function of a row.
+        """
+        if func is None:
+            return lambda row: row
+        argcount = func.__code__.co_argcount
+        if argcount == 1:
+            return func
+        if argcount == 2:
+            return lambda row: func(self._row_num, row)
+        if argcount == 3:
+            return lambda row: func(self._run_num, self._row_cnt, row)
+        assert False, f"Expected 1 to 3 arguments of \"transformer\" function, got {argcount}"
+
+    def _add_rows(self, rows, row_data):
+        if not row_data:
+            return
+        if self._nested is None:
+            # output shape is found out by the first returned data
+            self._nested = isinstance(row_data, (list, tuple)) and isinstance(row_data[0], (list, tuple))
+        if self._nested:
+            rows.extend(row_data)
+        else:
+            rows.append(row_data)
 
     def read(self, limit=0):
         logger.debug(f"read: limit={limit}")
         if limit == -1:
             self._close_reader()
         self._fetch_reader()
-        rows = [] if self._reader else None
+        batching = self._spec.get('transformer_batch', False)
+        rows = [] if self._reader or self._pending else None
+        if self._pending:
+            # rows left over from the previous batch
+            rows, self._pending = self._pending, []
+            if limit > 0 and len(rows) >= limit:
+                rows, self._pending = rows[:limit], rows[limit:]
+                logger.debug(f"read: {len(rows)} rows")
+                return rows
         while self._reader:
+            batch = []
             for row in self._reader:
                 self._row_cnt += 1
                 self._row_num += 1
+                if self._row_num % 1000000 == 0:
+                    logger.debug(f"{self._row_num // 1000000} mln rows")
                 if self._row_num <= self._spec.get('skip_lines', 0):
                     continue
 
-                func = self._spec.get('transformer', [None])[0]
-                row_data = \
-                    func(row) if func and func.__code__.co_argcount == 1 else \
-                    func(self._row_num, row) if func and func.__code__.co_argcount == 2 else \
-                    func(self._run_num, self._row_cnt, row) if func and func.__code__.co_argcount == 3 else \
-                    row if self._spec.get('text_lines', False) else \
-                    row
-                if isinstance(row_data, (list, tuple)) and row_data and not isinstance(row_data[0], (list, tuple)):
-                    rows.append(row_data)
-                elif isinstance(row_data, (list, tuple)) and row_data and isinstance(row_data[0], (list, tuple)):
-                    rows.extend(row_data)
-                elif row_data and self._spec.get('text_lines', False):
-                    rows.append(row_data)
-                #print(f"{self._row_cnt} : {self._row_num} : {row_data}")
-                if self._row_num % 1000000 == 0:
-                    logger.debug(f"{self._row_num // 1000000} mln rows")
+                if batching:
+                    batch.append(row)
+                    if len(batch) < (limit - len(rows) if limit > 0 else ONE_BATCH_ROWS):
+                        continue
+                    rows.extend(self._transform(batch) or [])
+                    batch = []
+                else:
+                    self._add_rows(rows, self._transform(row))
 
-                if limit > 0 and len(rows) == limit:
+                if limit > 0 and len(rows) >= limit:
                     break # for
 
+            if batch:
+                rows.extend(self._transform(batch) or [])
+            if limit > 0 and len(rows) > limit:
+                # keep rows returned beyond the limit for the next read
+                rows, self._pending = rows[:limit], rows[limit:]
+
             if limit == -1:
                 # all rows of a reader have been read, exit while loop
                 self._close_reader()
@@ -425,6 +505,114 @@ class RowsWriter():
             for f in row
             )
 
+    @staticmethod
+    def _convert_rows(rows, convert, converters, none=None):
+        # convert column by column: a column with values of one type by converter for the type
+        # or as is if the converter is None, any other column by convert
+        if len(set(map(len, rows))) != 1:
+            # no rows or rows of different length
+            return [convert(row) for row in rows]
+        columns = list(zip(*rows))
+        for i, column in enumerate(columns):
+            types = set(map(type, column))
+            nullable = type(None) in types
+            types.discard(type(None))
+            kind = types.pop() if len(types) == 1 else None
+            if kind not in converters:
+                # mixed types, all nulls or unknown type
+                columns[i] = convert(column)
+            elif converters[kind] is None:
+                if nullable and none is not None:
+                    columns[i] = tuple(none if f is None else f for f in column)
+            elif nullable:
+                to = converters[kind]
+                columns[i] = tuple(none if f is None else to(f) for f in column)
+            else:
+                columns[i] = tuple(map(converters[kind], column))
+        return list(zip(*columns))
+
+    @classmethod
+    def _csv_rows(cls, rows, dec_sep='.'):
+        number = str if dec_sep == '.' else lambda f: str(f).replace('.', dec_sep)
+        return cls._convert_rows(
+            rows,
+            lambda row: cls._csv_row(row, dec_sep),
+            {
+                str: None,
+                int: str,
+                bool: str,
+                float: number,
+                dec.Decimal: number,
+                datetime: lambda f: f.strftime(DATETIME_FORMAT),
+                date: lambda f: f.strftime(DATE_FORMAT),
+            },
+            none=''
+        )
+
+    @classmethod
+    def _jinja_rows(cls, rows):
+        return cls._convert_rows(
+            rows,
+            cls._jinja_row,
+            {
+                str: None,
+                int: None,
+                bool: None,
+                float: None,
+                dec.Decimal: float,
+                datetime: lambda f: f.strftime(DATETIME_FORMAT),
+                date: lambda f: f.strftime(DATE_FORMAT),
+            }
+        )
+
+    @classmethod
+    def _xlsx_rows(cls, rows):
+        return cls._convert_rows(
+            rows,
+            cls._xlsx_row,
+            {
+                str: None,
+                int: None,
+                bool: None,
+                float: None,
+                dec.Decimal: None,
+                date: None,
+                datetime: lambda f: f.replace(tzinfo=None),
+                time: lambda f: f.replace(tzinfo=None),
+            }
+        )
+
+    @staticmethod
+    def _arrow_schema(titles, rows):
+        import pyarrow as pa
+        fields = []
+        for title, col in zip(titles, zip(*rows)):
+            col_type = pa.array(col).type
+            if pa.types.is_decimal(col_type):
+                # the widest precision and a scale to spare for later batches
+                col_type = pa.decimal128(38, min(max(col_type.scale, 18), 38))
+            elif pa.types.is_null(col_type):
+                # all values are None, so fall back to string
+                col_type = pa.string()
+            fields.append(pa.field(str(title), col_type))
+        return pa.schema(fields)
+
+    @staticmethod
+    def _arrow_batch(schema, rows):
+        import pyarrow as pa
+        arrays = []
+        for field, col in zip(schema, zip(*rows)):
+            if pa.types.is_string(field.type):
+                # string columns take values of other types as text
+                arrays.append(pa.array([v if v is None or isinstance(v, str) else str(v) for v in col], type=field.type))
+                continue
+            # cast safely, so that e.g. 1.5 in an integer column raises rather than gets truncated
+            try:
+                arrays.append(pa.array(col).cast(field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError) as e:
+                raise ValueError(f"Column \"{field.name}\" values do not fit {field.type}: {e}") from e
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
     @staticmethod
     def _file_stem(stem, parts, seqn, user):
         filename_dict = dict()
@@ -440,32 +628,35 @@ class RowsWriter():
         return stem % filename_dict
 
     @staticmethod
-    def _finalize_file(filename, compress=False):
+    def _open_file(filename, compress=None, encoding=None):
+        if not compress:
+            return open(filename, 'w', encoding=encoding, errors='replace') if encoding else open(filename, 'wb')
+        # compressed file keeps the name of data file without trailing '.out'
+        file = io.BufferedWriter(CompressingFile(filename, compress, os.path.basename(filename[:-4])), 1024 * 1024)
+        return io.TextIOWrapper(file, encoding=encoding, errors='replace') if encoding else file
+
+    @staticmethod
+    def _finalize_file(filename, compress=None):
         _filename = filename[:-4]  # remove trailing '.out'
         if compress:
-            import zipfile
-            _zipfilename = _filename + '.zip'
-            with zipfile.ZipFile(_zipfilename, 'w') as zf:
-                zf.write(filename, arcname=os.path.basename(_filename))
-            os.remove(filename)
-            logger.info(f"fo: {os.path.basename(_zipfilename)}")
-        else:
-            # os.rename: On Windows, if dst exists a FileExistsError is always raised.
-            if os.path.isfile(_filename):
-                os.remove(_filename)
-            os.rename(filename, _filename)
-            logger.info(f"fo: {os.path.basename(_filename)}")
+            # the file is compressed already while writing
+            _filename += f".{compress}"
+        # os.rename: On Windows, if dst exists a FileExistsError is always raised.
+        if os.path.isfile(_filename):
+            os.remove(_filename)
+        os.rename(filename, _filename)
+        logger.info(f"fo: {os.path.basename(_filename)}")
 
     def write(self):
         assert self._file_name, \
             f"Output file not specified, spec \"{self._spec_name}\""
         out_base, out_format = self._file_name.rsplit('.', 1)
-        if out_format == 'zip':
-            out_compress = True
+        if out_format in ('zip', 'gz', 'zst'):
+            out_compress = out_format
             out_base, out_format = out_base.rsplit('.', 1)
         else:
-            out_compress = False
-        assert out_format in ('html', 'csv', 'xlsx', 'json') or \
+            out_compress = None
+        assert out_format in ('html', 'csv', 'xlsx', 'json', 'parquet', 'arrow') or \
             self._spec.get('text_lines', False) or (
             isinstance(self._spec.get('template'), str) and
             self._spec['template'].endswith(".jinja") and
@@ -510,7 +701,7 @@ class RowsWriter():
                         out_file = self._file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
                         seqn += 1
                         out_file = os.path.join(out_path, out_file)
-                        file = open(out_file, 'w', encoding=encoding, errors='replace')
+                        file = self._open_file(out_file, out_compress, encoding)
                         # no header
                     # next row
                     file.write(row)
@@ -548,7 +739,7 @@ class RowsWriter():
                     out_file = self._file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
                     seqn += 1
                     out_file = os.path.join(out_path, out_file)
-                    file = open(out_file, 'w', encoding=encoding, errors='replace')
+                    file = self._open_file(out_file, out_compress, encoding)
                     # header row
                     if not self._spec.get('header'):
                         self._spec['header'] = []
@@ -557,7 +748,7 @@ class RowsWriter():
                             title=self._spec.get(f"{out_format}.title", self._spec_name),
                             titles=self._spec['header'] if self._spec.get('header') and self._spec.get(f"csv.header", True) or out_format == 'json' else [],
                             dec_sep=self._spec.get(f"{out_format}.dec_separator", '.'),
-                            rows=[self._jinja_row(row) for row in rows],
+                            rows=self._jinja_rows(rows),
                             zip=zip
                         )
                     )
@@ -590,13 +781,13 @@ class RowsWriter():
                 if rows is None:
                     # no file was read
                     break
-                for row in rows:
+                for row in self._csv_rows(rows, dec_separator):
                     # begin file
                     if file is None:
                         out_file = self._file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
                         seqn += 1
                         out_file = os.path.join(out_path, out_file)
-                        file = open(out_file, 'w', encoding=encoding, errors='replace')
+                        file = self._open_file(out_file, out_compress, encoding)
                         if csv_dialect == 'naive':
                             pass
                         else:
@@ -615,9 +806,9 @@ class RowsWriter():
                                 csv_writer.writerow(self._spec['header'])
                     # next row
                     if csv_dialect == 'naive':
-                        file.write(csv_delimiter.join(self._csv_row(row, dec_separator)) + '\n')
+                        file.write(csv_delimiter.join(row) + '\n')
                     else:
-                        csv_writer.writerow(self._csv_row(row, dec_separator))
+                        csv_writer.writerow(row)
                 # end file
                 if file:
                     file.close()
@@ -643,7 +834,7 @@ class RowsWriter():
                 if rows is None:
                     # no file was read
                     break
-                for row in rows:
+                for row in self._xlsx_rows(rows):
                     # begin file
                     if file is None:
                         out_file = self._file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
@@ -659,11 +850,57 @@ class RowsWriter():
                                 title.font = font
                             sheet.append(titles)
                     # next row
-                    sheet.append(self._xlsx_row(row))
+                    sheet.append(row)
+                # end file
+                if file:
+                    with self._open_file(out_file, out_compress) as f:
+                        file.save(f)
+                    file.close()
+                    self._finalize_file(out_file, out_compress)
+                    logger.info("fo: %s rows", len(rows))
+                else:
+                    logger.info("fo: nothing to write")
+                file = None
+
+        elif out_format in ('parquet', 'arrow'):
+            #
+            # create .parquet or .arrow file(s), one record batch per file
+            #
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            while True:
+                try:
+                    rows = self._reader.read(rows_per_file)
+                except:
+                    if rows_per_file == -1 and self._spec['skip_bad_files']:
+                        logger.exception('EXCEPT')
+                        seqn += 1
+                        continue
+                    raise
+                if rows is None:
+                    # no file was read
+                    break
+                if len(rows) > 0:
+                    out_file = self._file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
+                    seqn += 1
+                    out_file = os.path.join(out_path, out_file)
+                    # header row
+                    titles = self._spec.get('header') or [f"c{i+1}" for i in range(len(rows[0]))]
+                    schema = self._arrow_schema(titles, rows)
+                    sink = self._open_file(out_file, out_compress)
+                    if out_format == 'parquet':
+                        file = pq.ParquetWriter(
+                            sink,
+                            schema,
+                            compression=self._spec.get('parquet.compression', 'snappy')
+                        )
+                    else:
+                        file = pa.ipc.new_file(sink, schema)
+                    file.write_batch(self._arrow_batch(schema, rows))
                 # end file
                 if file:
-                    file.save(out_file)
                     file.close()
+                    sink.close()
                     self._finalize_file(out_file, out_compress)
                     logger.info("fo: %s rows", len(rows))
                 else:
@@ -5,11 +5,15 @@ import sys
 import locale
 import re
 import csv
+import io
+import json
 import glob
 import argparse
 import logging
 import decimal as dec
 from datetime import date, datetime, time
+from time import perf_counter
+import queue
 import threading
 
 from openpyxl import Workbook, styles
@@ -21,6 +25,8 @@ from jinja2 import (
     select_autoescape
 )
 
+from dio import CompressingFile
+
 
 VERSION = '0.4.0'
 
@@ -91,6 +97,8 @@ if not os.path.isdir(OUT_DIR):
     sys.exit(1)
 
 PARALLEL_WORKERS = min(getattr(cfg, 'PARALLEL_WORKERS', 1), 8)
+# run specs longest first, by their durations in previous runs
+LONGEST_FIRST = getattr(cfg, 'LONGEST_FIRST', False)
 
 DEBUGGING = getattr(cfg, 'DEBUGGING', False)
 LOGGING = getattr(cfg, 'LOGGING', DEBUGGING)
@@ -128,6 +136,15 @@ CSV_DELIMITER = getattr(cfg, 'CSV_DELIMITER', None) or csv.get_dialect(CSV_DIALE
 
 # number of rows to fetch with one fetch
 ONE_FETCH_ROWS = 5000
+# number of rows to fetch with one fetch, or "auto" to adapt it while fetching
+FETCH_ROWS = getattr(cfg, 'FETCH_ROWS', ONE_FETCH_ROWS)
+# memory limit for one fetch when fetch rows number is adapted
+MAX_FETCH_BYTES = 64 * 1024 * 1024
+# number of fetched batches buffered per partition of partitioned spec
+PARTITION_QUEUE_SIZE = getattr(cfg, 'PARTITION_QUEUE_SIZE', 4)
+# durations and watermarks of specs
+STAT_FILE = os.path.join(TEMP_DIR, f".dget.{CFG_MODULE}.json")
+STAT_LOCK = threading.Lock()
 # number of gets preserved per entity
 PRESERVE_N_TRACES = getattr(cfg, 'PRESERVE_N_TRACES', 10)
 
@@ -191,6 +208,116 @@ def exec_sql(con, sql):
         cur.close()
 
 
+def server_cursor(con, source):
+    """
+    Open cursor that streams rows from DB server instead of buffering
+    the whole result set at client side.
+    """
+    if source['database'] == 'postgresql':
+        # psycopg named cursor is a server-side cursor
+        return con.cursor(name='dget')
+    else:
+        # mysql.connector cursors are unbuffered by default;
+        # oracledb, mssql_python and sqlite3 cursors fetch rows by arraysize anyway
+        return con.cursor()
+
+
+def connect(source):
+    """
+    Connect to DB source and setup the session.
+    """
+    con = \
+        source['lib'].connect(source['con_string'], **source.get('con_kwargs', dict())) \
+        if source.get('con_string') else \
+        source['lib'].connect(**source['con_kwargs'])
+    if source.get('setup'):
+        logger.debug('-- setup')
+        exec_sql(con, source['setup'])
+    return con
+
+
+def disconnect(con, source):
+    """
+    Release the session and close connection to DB source.
+    """
+    if source.get('upset'):
+        logger.debug('-- upset')
+        exec_sql(con, source['upset'])
+    con.close()
+
+
+#
+# BEGIN DB SPECIFIC STUFF
+#
+
+BIND_VARIABLE = {
+    "mssql": "%({})s",
+    "mysql": "%({})s",
+    "oracle": ":{}",
+    "postgresql": "%({})s",
+    "sqlite": ":{}",
+}
+
+# modulo expressions free of '%' that would clash with pyformat bind variables
+MODULO = {
+    "mssql": "({0} - {0} / {1} * {1})",
+    "mysql": "mod({0}, {1})",
+    "oracle": "mod({0}, {1})",
+    "postgresql": "mod({0}, {1})",
+    "sqlite": "({0} % {1})",
+}
+
+#
+# END DB SPECIFIC STUFF
+#
+
+
+def partition_queries(source, spec, query, qargs):
+    """
+    Split query into queries for partitions defined by spec "partition_by".
+    """
+    partition_by = spec['partition_by']
+    assert isinstance(partition_by, dict) and isinstance(partition_by.get('column'), str), \
+        f"Bad \"partition_by\": {partition_by}"
+    column = partition_by['column']
+    bind = BIND_VARIABLE[source['database']]
+    partitions = []
+    if partition_by.get('buckets'):
+        buckets = partition_by['buckets']
+        assert isinstance(buckets, int) and buckets > 1, f"Bad \"buckets\": {buckets}"
+        # non-negative remainder for negative values of the column too
+        modulo = MODULO[source['database']]
+        modulo = modulo.format(f"({modulo.format(column, buckets)} + {buckets})", buckets)
+        where = f"{modulo} = {bind.format('partition_bucket')}"
+        for bucket in range(buckets):
+            partitions.append((
+                # rows with NULL in the column go to the first bucket
+                f"select * from ({query}) partitioned where {where}" + (f" or {column} is null" if bucket == 0 else ''),
+                dict(qargs, partition_bucket=bucket)
+            ))
+    else:
+        ranges = partition_by.get('ranges')
+        assert isinstance(ranges, (list, tuple)) and ranges, f"Bad \"ranges\": {ranges}"
+        for n, (lo, hi) in enumerate(ranges):
+            where = []
+            pargs = dict(qargs)
+            if lo is not None:
+                where.append(f"{column} >= {bind.format('partition_lo')}")
+                pargs['partition_lo'] = lo
+            if hi is not None:
+                where.append(f"{column} < {bind.format('partition_hi')}")
+                pargs['partition_hi'] = hi
+            where = ' and '.join(where)
+            if where and n == 0:
+                # rows with NULL in the column go to the first range
+                where = f"{where} or {column} is null"
+            partitions.append((
+                f"select * from ({query}) partitioned" + (f" where {where}" if where else ''),
+                pargs
+            ))
+    return partitions
+
+
 def csv_row(row, dec_sep='.'):
     return tuple(
         '' if f == None else \
@@ -221,29 +348,369 @@ def xlsx_row(row):
         )
 
 
-def rows_from_cursor(cur, first_row=None, fetch_rows=0):
+def convert_rows(rows, convert, converters, none=None):
+    """
+    Convert batch of rows column by column. A column with values of one type
+    is converted by the converter for this type, or passed as is if the
+    converter is None. Any other column is converted by convert.
+    """
+    if len(set(map(len, rows))) != 1:
+        # no rows or rows of different length
+        return [convert(row) for row in rows]
+    columns = list(zip(*rows))
+    for i, column in enumerate(columns):
+        types = set(map(type, column))
+        nullable = type(None) in types
+        types.discard(type(None))
+        kind = types.pop() if len(types) == 1 else None
+        if kind not in converters:
+            # mixed types, all nulls or unknown type
+            columns[i] = convert(column)
+        elif converters[kind] is None:
+            if nullable and none is not None:
+                columns[i] = tuple(none if f is None else f for f in column)
+        elif nullable:
+            to = converters[kind]
+            columns[i] = tuple(none if f is None else to(f) for f in column)
+        else:
+            columns[i] = tuple(map(converters[kind], column))
+    return list(zip(*columns))
+
+
+def csv_rows(rows, dec_sep='.'):
+    number = str if dec_sep == '.' else lambda f: str(f).replace('.', dec_sep)
+    return convert_rows(
+        rows,
+        lambda row: csv_row(row, dec_sep),
+        {
+            str: None,
+            int: str,
+            bool: str,
+            float: number,
+            dec.Decimal: number,
+            datetime: lambda f: f.strftime(DATETIME_FORMAT),
+            date: lambda f: f.strftime(DATE_FORMAT),
+        },
+        none=''
+    )
+
+
+def jinja_rows(rows):
+    return convert_rows(
+        rows,
+        jinja_row,
+        {
+            str: None,
+            int: None,
+            bool: None,
+            float: None,
+            dec.Decimal: float,
+            datetime: lambda f: f.strftime(DATETIME_FORMAT),
+            date: lambda f: f.strftime(DATE_FORMAT),
+        }
+    )
+
+
+def xlsx_rows(rows):
+    return convert_rows(
+        rows,
+        xlsx_row,
+        {
+            str: None,
+            int: None,
+            bool: None,
+            float: None,
+            dec.Decimal: None,
+            date: None,
+            datetime: lambda f: f.replace(tzinfo=None),
+            time: lambda f: f.replace(tzinfo=None),
+        }
+    )
+
+
+def arrow_schema(titles, description, rows):
+    """
+    Build pyarrow schema from column titles, cursor description and data
+    types of the rows, so that the schema fits the rows of later batches too.
+    """
+    import pyarrow as pa
+    fields = []
+    for title, d, col in zip(titles, description, zip(*rows)):
+        col_type = pa.array(col).type
+        if pa.types.is_integer(col_type) and len(d) > 5 and isinstance(d[5], int) and d[5] > 0:
+            # integer values of a column with fractional digits, e.g. numeric(10,2)
+            col_type = pa.decimal128(38, min(max(d[5], 18), 38))
+        if pa.types.is_decimal(col_type):
+            # precision and scale of the column if the driver tells them,
+            # otherwise the widest precision and a scale to spare
+            precision, scale = d[4:6] if len(d) > 5 else (None, None)
+            if isinstance(precision, int) and isinstance(scale, int) and 0 <= scale <= precision <= 38:
+                col_type = pa.decimal128(precision, scale)
+            else:
+                col_type = pa.decimal128(38, min(max(col_type.scale, 18), 38))
+        elif pa.types.is_null(col_type):
+            # all values are None, so fall back to string
+            col_type = pa.string()
+        fields.append(pa.field(str(title), col_type))
+    return pa.schema(fields)
+
+
+def arrow_batch(schema, rows):
+    """
+    Convert rows into pyarrow record batch of the schema. Values are
+    converted to their own types first and then cast safely, so a value
+    the schema type cannot hold (e.g. 1.5 in an integer column) raises
+    an error rather than gets truncated.
+    """
+    import pyarrow as pa
+    arrays = []
+    for field, col in zip(schema, zip(*rows)):
+        if pa.types.is_string(field.type):
+            # string columns take values of other types as text
+            arrays.append(pa.array([v if v is None or isinstance(v, str) else str(v) for v in col], type=field.type))
+            continue
+        try:
+            arrays.append(pa.array(col).cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError) as e:
+            raise ValueError(f"Column \"{field.name}\" values do not fit {field.type}: {e}") from e
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class Fetcher():
+    """
+    Fetch rows from cursor by batches of fixed or adaptive ("auto") size.
+    """
+    def __init__(self, cur, fetch_rows=FETCH_ROWS):
+        assert fetch_rows == 'auto' or (isinstance(fetch_rows, int) and fetch_rows > 0), \
+            f"Bad \"fetch_rows\": {fetch_rows}"
+        self._cur = cur
+        self._adaptive = fetch_rows == 'auto'
+        self._throughput = 0
+        self.rows = ONE_FETCH_ROWS if self._adaptive else fetch_rows
+        self._set_arraysize()
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def _set_arraysize(self):
+        # let the driver get the whole batch with one round trip
+        self._cur.arraysize = self.rows
+        if hasattr(self._cur, 'prefetchrows'):
+            # oracledb: rows returned with the execute round trip
+            self._cur.prefetchrows = self.rows + 1
+
+    def _adapt(self, rows, seconds):
+        throughput = len(rows) / max(seconds, 1e-6)
+        row_bytes = sum(sys.getsizeof(f) for f in rows[0]) or 1
+        max_rows = max(100, MAX_FETCH_BYTES // row_bytes)
+        if self.rows > max_rows:
+            # rows are too wide to fetch that many at once
+            self.rows = max_rows
+        elif throughput > self._throughput * 1.1:
+            # bigger batch still pays off
+            self.rows = min(self.rows * 2, max_rows)
+            self._throughput = throughput
+        elif throughput < self._throughput * 0.9:
+            # bigger batch does not pay off, step back and stay there
+            self.rows = max(self.rows // 2, 100)
+            self._adaptive = False
+        else:
+            self._adaptive = False
+        if not self._adaptive:
+            logger.debug("fetch %s rows at once", self.rows)
+        self._set_arraysize()
+
+    def fetchmany(self, size=None):
+        size = size or self.rows
+        t = perf_counter()
+        rows = self._cur.fetchmany(size)
+        t = perf_counter() - t
+        if self._adaptive and len(rows) == self.rows:
+            self._adapt(rows, t)
+        return rows
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+
+class PartitionFetcher():
+    """
+    Fetch rows of partition queries executed in parallel on separate
+    connections, partition after partition in the order of partitions.
+    Every partition is fetched ahead into a queue of its own.
+    """
+    def __init__(self, source, partitions, fetch_rows=FETCH_ROWS, setup=None):
+        self._queues = [queue.Queue(maxsize=PARTITION_QUEUE_SIZE) for _ in partitions]
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._fetch, args=(q, source, setup, query, qargs, fetch_rows), daemon=True)
+            for q, (query, qargs) in zip(self._queues, partitions)
+        ]
+        self._buffer = []
+        self._part = 0
+        self.rows = ONE_FETCH_ROWS if fetch_rows == 'auto' else fetch_rows
+        try:
+            for thread in self._threads:
+                thread.start()
+            # every partition thread puts cursor description first
+            self.description = self._get(0)[1]
+            for part in range(1, len(self._queues)):
+                self._get(part)
+        except:
+            self.close()
+            raise
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _fetch(self, q, source, setup, query, qargs, fetch_rows):
+        try:
+            con = connect(source)
+            try:
+                if setup:
+                    logger.debug('-- spec setup')
+                    exec_sql(con, setup)
+                cur = server_cursor(con, source) if source.get('server_cursor') else con.cursor()
+                fetcher = Fetcher(cur, fetch_rows)
+                logger.debug('\n\n%s\n\n%s\n', query.strip(), str(qargs))
+                cur.execute(query, qargs)
+                self._put(q, ('description', cur.description))
+                while not self._stop.is_set():
+                    rows = fetcher.fetchmany()
+                    if not rows:
+                        break
+                    self._put(q, ('rows', rows))
+                self._put(q, ('done', None))
+                cur.close()
+                con.rollback()
+            finally:
+                disconnect(con, source)
+        except Exception as e:
+            self._put(q, e)
+
+    def _get(self, part):
+        item = self._queues[part].get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def fetchmany(self, size=None):
+        size = size or self.rows
+        while len(self._buffer) < size and self._part < len(self._queues):
+            kind, rows = self._get(self._part)
+            if kind == 'done':
+                # partition is fetched, go on with the next one
+                self._part += 1
+            elif kind == 'rows':
+                self._buffer.extend(rows)
+        rows, self._buffer = self._buffer[:size], self._buffer[size:]
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            if thread.ident:
+                thread.join()
+
+
+class Watermark():
+    """
+    Pass rows from fetcher through, keeping the greatest value of
+    the watermark column.
+    """
+    def __init__(self, fetcher, index):
+        self._fetcher = fetcher
+        self._index = index
+        self.mark = None
+
+    def __getattr__(self, name):
+        return getattr(self._fetcher, name)
+
+    def _track(self, rows):
+        values = [row[self._index] for row in rows if row[self._index] is not None]
+        if values:
+            top = max(values)
+            if self.mark is None or top > self.mark:
+                # fail while fetching, before output files are finalized,
+                # if the mark could not be saved
+                watermark_to_json(top)
+                self.mark = top
+
+    def fetchmany(self, size=None):
+        rows = self._fetcher.fetchmany(size)
+        self._track(rows)
+        return rows
+
+    def fetchone(self):
+        row = self._fetcher.fetchone()
+        if row:
+            self._track([row])
+        return row
+
+
+def watermark_to_json(value):
+    """
+    Convert watermark value to [type, value] pair to be saved in JSON.
+    """
+    if isinstance(value, datetime):
+        return ['datetime', value.isoformat()]
+    elif isinstance(value, date):
+        return ['date', value.isoformat()]
+    elif isinstance(value, dec.Decimal):
+        return ['decimal', str(value)]
+    elif isinstance(value, (int, float, str)):
+        return [type(value).__name__, value]
+    else:
+        raise TypeError(f"Unsupported watermark type {type(value).__name__}")
+
+
+def watermark_from_json(pair):
+    """
+    Convert [type, value] pair saved in JSON to watermark value.
+    """
+    kind, value = pair
+    if kind == 'datetime':
+        return datetime.fromisoformat(value)
+    elif kind == 'date':
+        return date.fromisoformat(value)
+    elif kind == 'decimal':
+        return dec.Decimal(value)
+    else:
+        return value
+
+
+def rows_from_cursor(fetcher, first_row=None, fetch_rows=0):
     rowcount = 0
     if first_row:
         yield jinja_row(first_row)
         rowcount += 1
         while True:
             how_many = \
-                ONE_FETCH_ROWS if fetch_rows == 0 else \
-                fetch_rows - 1 if fetch_rows <= ONE_FETCH_ROWS else \
-                ONE_FETCH_ROWS if ONE_FETCH_ROWS <= (fetch_rows - 1 - rowcount) else \
-                fetch_rows - 1 - ONE_FETCH_ROWS
-            rows = cur.fetchmany(how_many)
+                fetcher.rows if fetch_rows == 0 else \
+                fetch_rows - 1 if fetch_rows <= fetcher.rows else \
+                fetcher.rows if fetcher.rows <= (fetch_rows - 1 - rowcount) else \
+                fetch_rows - 1 - fetcher.rows
+            rows = fetcher.fetchmany(how_many)
             if not rows:
                 break
-            for row in rows:
-                yield jinja_row(row)
-                rowcount += 1
+            yield from jinja_rows(rows)
+            rowcount += len(rows)
             if fetch_rows and rowcount == fetch_rows:
                 break
     logger.info("Got %s rows.", rowcount)
 
 
-def file_stem(stem, parts, seqn, user):
+def file_stem(stem, parts, seqn, user, partition=None):
     filename_dict = dict()
     for part in parts:
         if part == 'date':
@@ -254,22 +721,43 @@ def file_stem(stem, parts, seqn, user):
             filename_dict['seqn'] = seqn
         elif part == 'user':
             filename_dict['user'] = user
+        elif part == 'part':
+            filename_dict['part'] = partition
     return stem % filename_dict
 
 
-def finalize_file(filename, compress=False):
+def open_file(filename, compress=None, encoding=None):
+    """
+    Open output file for writing, in text mode if encoding is set,
+    compressing data on the fly if compress is "zip", "gz" or "zst".
+    """
+    if not compress:
+        return open(filename, 'w', encoding=encoding, errors='replace') if encoding else open(filename, 'wb')
+    # compressed file keeps the name of data file without trailing '.out'
+    file = io.BufferedWriter(CompressingFile(filename, compress, os.path.basename(filename[:-4])), 1024 * 1024)
+    return io.TextIOWrapper(file, encoding=encoding, errors='replace') if encoding else file
+
+
+def finalize_file(filename, compress=None):
     _filename = filename[:-4]  # remove trailing '.out'
     if compress:
-        import zipfile
-        _zipfilename = _filename + '.zip'
-        with zipfile.ZipFile(_zipfilename, 'w') as zf:
-            zf.write(filename, arcname=os.path.basename(_filename))
-        os.remove(filename)
-    else:
-        # os.rename: On Windows, if dst exists a FileExistsError is always raised.
-        if os.path.isfile(_filename):
-            os.remove(_filename)
-        os.rename(filename, _filename)
+        # the file is compressed already while writing
+        _filename += f".{compress}"
+    # os.rename: On Windows, if dst exists a FileExistsError is always raised.
+    if os.path.isfile(_filename):
+        os.remove(_filename)
+    os.rename(filename, _filename)
+
+
+def save_stat(stat, spec_name=None, **values):
+    """
+    Update spec stat with values and save all stat to STAT_FILE.
+    """
+    with STAT_LOCK:
+        if spec_name:
+            stat[spec_name] = dict(stat.get(spec_name, {}), **values)
+        with open(STAT_FILE, 'w', encoding='UTF-8') as f:
+            f.write(json.dumps({k: v for k, v in stat.items() if k in specs}))
 
 
 def trace(ts, status):
@@ -300,21 +788,253 @@ def trace(ts, status):
     logger.debug("trace %s", this_trace + str(status))
 
 
-def process_spec(con, run, spec_name, spec, out_file):
+def write_files(run, spec_name, spec, fetcher, out_base, out_format, out_compress, partition=None):
+    """
+    Write rows fetched by fetcher to output file(s).
+    """
+    out_path = spec.get('out_dir', OUT_DIR)
+    rows_per_file = spec.get('rows_per_file', 0)
+    encoding = spec.get(f"{out_format}.encoding", ENCODING)
+    filename_parts = re.findall(r'%\((.+?)\)', out_base)
+
+    file = None
+    seqn = 0
+    rowcount = 0
+    if out_format == 'html' or (out_format == 'json' and spec.get('json.template')):
+        #
+        # create .json or .html file(s) using jinja2 template
+        #
+        template = spec.get(f"{out_format}.template", None)
+        if template and os.path.isfile(os.path.join(TEMPLATES_DIR, template)):
+            template = env.get_template(template)
+        else:
+            template = json_tpl if out_format == 'json' else html_tpl
+        while True:
+            first_row = fetcher.fetchone()
+            if not first_row:
+                break
+            else:
+                out_file = file_stem(out_base, filename_parts, seqn, args.user, partition) + f".{out_format}.out"
+                seqn += 1
+                out_file = os.path.join(out_path, out_file)
+                file = open_file(out_file, out_compress, encoding)
+                file.write(
+                    template.render(
+                        run=run,
+                        title=spec.get(f"{out_format}.title", spec_name),
+                        titles=spec['header'] if spec.get(f"csv.header", True) or out_format == 'json' else [],
+                        source=spec['source'],
+                        dec_sep=spec.get(f"{out_format}.dec_separator", '.'),
+                        rows=rows_from_cursor(fetcher, first_row, rows_per_file),
+                        zip=zip
+                    )
+                )
+                file.close()
+                finalize_file(out_file, out_compress)
+
+    elif out_format == 'json':
+        #
+        # create .json file(s) row by row, as JSON array or JSON lines
+        #
+        json_lines = spec.get('json.lines', False)
+        json_encoder = json.JSONEncoder()
+        titles = spec['header']
+        while True:
+            rows = fetcher.fetchmany()
+            if not rows:
+                break
+            for row in jinja_rows(rows):
+                # begin file
+                if file is None:
+                    out_file = file_stem(out_base, filename_parts, seqn, args.user, partition) + f".{out_format}.out"
+                    seqn += 1
+                    out_file = os.path.join(out_path, out_file)
+                    file = open_file(out_file, out_compress, encoding)
+                    if not json_lines:
+                        file.write('[\n')
+                elif not json_lines:
+                    file.write(',\n')
+                # next row
+                file.write(json_encoder.encode(dict(zip(titles, row))))
+                if json_lines:
+                    file.write('\n')
+                rowcount += 1
+                if rows_per_file and rowcount % rows_per_file == 0:
+                    # end file
+                    if not json_lines:
+                        file.write('\n]\n')
+                    file.close()
+                    file = None
+                    finalize_file(out_file, out_compress)
+        if file:
+            # end file
+            if not json_lines:
+                file.write('\n]\n')
+            file.close()
+            file = None
+            finalize_file(out_file, out_compress)
+        logger.info("Got %s rows.", rowcount)
+
+    elif out_format == 'csv':
+        #
+        # create .csv file(s) line by line
+        #
+        dec_separator = spec.get('csv.dec_separator', '.')
+        csv_dialect = spec.get('csv.dialect', CSV_DIALECT)
+        csv_delimiter = spec.get('csv.delimiter', CSV_DELIMITER)
+        while True:
+            rows = fetcher.fetchmany()
+            if not rows:
+                break
+            for row in csv_rows(rows, dec_separator):
+                # begin file
+                if file is None:
+                    out_file = file_stem(out_base, filename_parts, seqn, args.user, partition) + f".{out_format}.out"
+                    seqn += 1
+                    out_file = os.path.join(out_path, out_file)
+                    file = open_file(out_file, out_compress, encoding)
+                    if csv_dialect == 'naive':
+                        pass
+                    else:
+                        csv_writer = \
+                            csv.writer(
+                                file,
+                                dialect=csv_dialect,
+                                delimiter=csv_delimiter,
+                                lineterminator='\n'
+                            )
+                    if spec.get('csv.header', True):
+                        if csv_dialect == 'naive':
+                            file.write(csv_delimiter.join(spec['header']) + '\n')
+                        else:
+                            csv_writer.writerow(spec['header'])
+                # next line
+                if csv_dialect == 'naive':
+                    file.write(csv_delimiter.join(row) + '\n')
+                else:
+                    csv_writer.writerow(row)
+                rowcount += 1
+                if rows_per_file and rowcount % rows_per_file == 0:
+                    # end file
+                    file.close()
+                    file = None
+                    finalize_file(out_file, out_compress)
+        if file:
+            # end file
+            file.close()
+            file = None
+            finalize_file(out_file, out_compress)
+        logger.info("Got %s rows.", rowcount)
+
+    elif out_format == 'xlsx':
+        #
+        # create .xlsx file(s) row by row
+        #
+        wb = None
+        while True:
+            rows = fetcher.fetchmany()
+            if not rows:
+                break
+            for row in xlsx_rows(rows):
+                # begin file
+                if wb is None:
+                    out_file = file_stem(out_base, filename_parts, seqn, args.user, partition) + f".{out_format}.out"
+                    seqn += 1
+                    out_file = os.path.join(out_path, out_file)
+                    wb = Workbook(write_only=True)
+                    ws = wb.create_sheet()
+                    font = styles.Font(bold=True)
+                    if spec.get('xlsx.header', True):
+                        titles = [WriteOnlyCell(ws, value=title) for title in spec['header']]
+                        for title in titles:
+                            title.font = font
+                        ws.append(titles)
+                # next row
+                ws.append(row)
+                rowcount += 1
+                if rows_per_file and rowcount % rows_per_file == 0:
+                    # end file
+                    with open_file(out_file, out_compress) as f:
+                        wb.save(f)
+                    wb.close()
+                    wb = None
+                    finalize_file(out_file, out_compress)
+        if wb:
+            # end file
+            with open_file(out_file, out_compress) as f:
+                wb.save(f)
+            wb.close()
+            wb = None
+            finalize_file(out_file, out_compress)
+        logger.info("Got %s rows.", rowcount)
+
+    elif out_format in ('parquet', 'arrow'):
+        #
+        # create .parquet or .arrow file(s) batch by batch
+        #
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = None
+        writer = None
+        while True:
+            rows = fetcher.fetchmany()
+            if not rows:
+                break
+            if schema is None:
+                schema = arrow_schema(spec['header'], fetcher.description, rows)
+            while rows:
+                # begin file
+                if writer is None:
+                    out_file = file_stem(out_base, filename_parts, seqn, args.user, partition) + f".{out_format}.out"
+                    seqn += 1
+                    out_file = os.path.join(out_path, out_file)
+                    file = open_file(out_file, out_compress)
+                    if out_format == 'parquet':
+                        writer = pq.ParquetWriter(
+                            file,
+                            schema,
+                            compression=spec.get('parquet.compression', 'snappy')
+                        )
+                    else:
+                        writer = pa.ipc.new_file(file, schema)
+                # next batch of rows, up to the end of file
+                how_many = rows_per_file - rowcount % rows_per_file if rows_per_file else len(rows)
+                writer.write_batch(arrow_batch(schema, rows[:how_many]))
+                rowcount += len(rows[:how_many])
+                rows = rows[how_many:]
+                if rows_per_file and rowcount % rows_per_file == 0:
+                    # end file
+                    writer.close()
+                    writer = None
+                    file.close()
+                    file = None
+                    finalize_file(out_file, out_compress)
+        if writer:
+            # end file
+            writer.close()
+            writer = None
+            file.close()
+            file = None
+            finalize_file(out_file, out_compress)
+        logger.info("Got %s rows.", rowcount)
+
+
+def process_spec(con, run, spec_name, spec, out_file, stat):
     """
     Process spec from config-file.
     """
     return_code = 0
+    partition_fetchers = []
     try:
         assert out_file or spec.get('file'), \
             f"Output file not specified, spec \"{spec_name}\""
         out_base, out_format = (out_file or spec.get('file')).rsplit('.', 1)
-        if out_format == 'zip':
-            out_compress = True
+        if out_format in ('zip', 'gz', 'zst'):
+            out_compress = out_format
             out_base, out_format = out_base.rsplit('.', 1)
         else:
-            out_compress = False
-        assert out_format in ('html', 'csv', 'xlsx', 'json') or (
+            out_compress = None
+        assert out_format in ('html', 'csv', 'xlsx', 'json', 'parquet', 'arrow') or (
             #isinstance(spec['template'], str) and
             spec['template'].endswith(".jinja") and
             os.path.isfile(os.path.join(CFG_DIR, spec['template']))
@@ -350,155 +1070,88 @@ def process_spec(con, run, spec_name, spec, out_file):
                 cur.execute(query)
             spec['header'] = cur.fetchone()
 
-        query = spec['query']
-        qargs = spec.get('bind_args', {})
-        if args.arg:
-            qargs = {k: v for k,v in zip(qargs.keys(), [type(v)(a) for v, a in zip(qargs.values(), args.arg)])}
-        logger.debug('\n\n%s\n\n%s\n', query.strip(), str(qargs))
-        cur.execute(query, qargs)
-        # if query returns query execute it
-        if len(cur.description) == 1 and cur.description[0][0] == 'query':
-            query = cur.fetchone()[0]
-            logger.debug('\n\n%s\n', query.strip())
-            cur.execute(query)
-
-        if not spec.get('header'):
-            spec['header'] = [d[0] for d in cur.description]
-
-        out_path = spec.get('out_dir', OUT_DIR)
-        rows_per_file = spec.get('rows_per_file', 0)
-        encoding = spec.get(f"{out_format}.encoding", ENCODING)
+        source = sources[spec['source']]
+        fetch_rows = spec.get('fetch_rows', source.get('fetch_rows', FETCH_ROWS))
 
         filename_parts = re.findall(r'%\((.+?)\)', out_base)
         assert not filename_parts or \
-            set(filename_parts) <= {'date', 'datetime', 'seqn', 'user'}, \
+            set(filename_parts) <= {'date', 'datetime', 'seqn', 'user', 'part'}, \
             f"Bad named fields in filename: {spec['file']}"
 
-        file = None
-        seqn = 0
-        rowcount = 0
-        if out_format in ('json', 'html'):
-            #
-            # create .json or .html file(s) using jinja2 template
-            #
-            template = spec.get(f"{out_format}.template", None)
-            if template and os.path.isfile(os.path.join(TEMPLATES_DIR, template)):
-                template = env.get_template(template)
+        query = spec['query']
+        qargs = spec.get('bind_args', {})
+        if args.arg:
+            qargs = {k: v for k,v in zip(qargs.keys(), [type(v)(a) for v, a in zip(qargs.values(), args.arg)])}
+        if spec.get('watermark'):
+            # bind high-water mark of the previous run, or initial one
+            assert isinstance(spec['watermark'], dict) and isinstance(spec['watermark'].get('column'), str) \
+                and isinstance(spec['watermark'].get('initial'), (type(None), datetime, date, dec.Decimal, int, float, str)), \
+                f"Bad \"watermark\" in spec \"{spec_name}\""
+            qargs = dict(
+                qargs,
+                watermark=watermark_from_json(stat[spec_name]['watermark'])
+                    if stat.get(spec_name, {}).get('watermark') else
+                    spec['watermark'].get('initial')
+            )
+        if spec.get('partition_by'):
+            # execute queries of partitions in parallel on separate connections
+            partitions = partition_queries(source, spec, query, qargs)
+            if 'part' in filename_parts:
+                # every partition to its own file(s)
+                for partition in partitions:
+                    partition_fetchers.append(PartitionFetcher(source, [partition], fetch_rows, spec.get('setup')))
             else:
-                template = json_tpl if out_format == 'json' else html_tpl
-            while True:
-                first_row = cur.fetchone()
-                if not first_row:
-                    break
-                else:
-                    out_file = file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
-                    seqn += 1
-                    out_file = os.path.join(out_path, out_file)
-                    file = open(out_file, 'w', encoding=encoding, errors='replace')
-                    file.write(
-                        template.render(
-                            run=run,
-                            title=spec.get(f"{out_format}.title", spec_name),
-                            titles=spec['header'] if spec.get(f"csv.header", True) or out_format == 'json' else [],
-                            source=spec['source'],
-                            dec_sep=spec.get(f"{out_format}.dec_separator", '.'),
-                            rows=rows_from_cursor(cur, first_row, rows_per_file),
-                            zip=zip
-                        )
-                    )
-                    file.close()
-                    finalize_file(out_file, out_compress)
-
-        elif out_format == 'csv':
-            #
-            # create .csv file(s) line by line
-            #
-            dec_separator = spec.get('csv.dec_separator', '.')
-            csv_dialect = spec.get('csv.dialect', CSV_DIALECT)
-            csv_delimiter = spec.get('csv.delimiter', CSV_DELIMITER)
-            while True:
-                rows = cur.fetchmany(ONE_FETCH_ROWS)
-                if not rows:
-                    break
-                for row in rows:
-                    # begin file
-                    if file is None:
-                        out_file = file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
-                        seqn += 1
-                        out_file = os.path.join(out_path, out_file)
-                        file = open(out_file, 'w', encoding=encoding, errors='replace')
-                        if csv_dialect == 'naive':
-                            pass
-                        else:
-                            csv_writer = \
-                                csv.writer(
-                                    file,
-                                    dialect=csv_dialect,
-                                    delimiter=csv_delimiter,
-                                    lineterminator='\n'
-                                )
-                        if spec.get('csv.header', True):
-                            if csv_dialect == 'naive':
-                                file.write(csv_delimiter.join(spec['header']) + '\n')
-                            else:
-                                csv_writer.writerow(spec['header'])
-                    # next line
-                    if csv_dialect == 'naive':
-                        file.write(csv_delimiter.join(csv_row(row, dec_separator)) + '\n')
-                    else:
-                        csv_writer.writerow(csv_row(row, dec_separator))
-                    rowcount += 1
-                    if rows_per_file and rowcount % rows_per_file == 0:
-                        # end file
-                        file.close()
-                        file = None
-                        finalize_file(out_file, out_compress)
-            if file:
-                # end file
-                file.close()
-                file = None
-                finalize_file(out_file, out_compress)
-            logger.info("Got %s rows.", rowcount)
+                # all partitions to the same file(s) in the order of partitions
+                partition_fetchers.append(PartitionFetcher(source, partitions, fetch_rows, spec.get('setup')))
+            fetchers = partition_fetchers
+            description = fetchers[0].description
+        else:
+            if source.get('server_cursor'):
+                cur.close()
+                cur = server_cursor(con, source)
+            fetchers = [Fetcher(cur, fetch_rows)]
+            logger.debug('\n\n%s\n\n%s\n', query.strip(), str(qargs))
+            cur.execute(query, qargs)
+            # if query returns query execute it
+            if len(cur.description) == 1 and cur.description[0][0] == 'query':
+                # fetch all to let streaming cursor execute the next query
+                query = cur.fetchall()[0][0]
+                logger.debug('\n\n%s\n', query.strip())
+                cur.execute(query)
+            description = cur.description
 
-        elif out_format == 'xlsx':
-            #
-            # create .xlsx file(s) row by row
-            #
-            wb = None
-            while True:
-                rows = cur.fetchmany(ONE_FETCH_ROWS)
-                if not rows:
-                    break
-                for row in rows:
-                    # begin file
-                    if wb is None:
-                        out_file = file_stem(out_base, filename_parts, seqn, args.user) + f".{out_format}.out"
-                        seqn += 1
-                        out_file = os.path.join(out_path, out_file)
-                        wb = Workbook(write_only=True)
-                        ws = wb.create_sheet()
-                        font = styles.Font(bold=True)
-                        if spec.get('xlsx.header', True):
-                            titles = [WriteOnlyCell(ws, value=title) for title in spec['header']]
-                            for title in titles:
-                                title.font = font
-                            ws.append(titles)
-                    # next row
-                    ws.append(xlsx_row(row))
-                    rowcount += 1
-                    if rows_per_file and rowcount % rows_per_file == 0:
-                        # end file
-                        wb.save(out_file)
-                        wb.close()
-                        wb = None
-                        finalize_file(out_file, out_compress)
-            if wb:
-                # end file
-                wb.save(out_file)
-                wb.close()
-                wb = None
-                finalize_file(out_file, out_compress)
-            logger.info("Got %s rows.", rowcount)
+        if not spec.get('header'):
+            spec['header'] = [d[0] for d in description]
+
+        if spec.get('watermark'):
+            columns = [d[0].lower() for d in description]
+            assert spec['watermark']['column'].lower() in columns, \
+                f"Watermark column \"{spec['watermark']['column']}\" not found, spec \"{spec_name}\""
+            # binary values could not be saved as the mark; other types are checked as they are fetched
+            type_code = description[columns.index(spec['watermark']['column'].lower())][1]
+            assert type_code is None or getattr(source['lib'], 'BINARY', None) is None or type_code != source['lib'].BINARY, \
+                f"Unsupported type of watermark column \"{spec['watermark']['column']}\", spec \"{spec_name}\""
+            fetchers = [Watermark(fetcher, columns.index(spec['watermark']['column'].lower())) for fetcher in fetchers]
+
+        if len(fetchers) == 1:
+            write_files(run, spec_name, spec, fetchers[0], out_base, out_format, out_compress)
+        else:
+            # write files of partitions in parallel
+            def write_partition(fetcher, partition):
+                try:
+                    write_files(run, spec_name, spec, fetcher, out_base, out_format, out_compress, partition)
+                except:
+                    logger.exception('EXCEPT')
+                    return 1
+                return 0
+            threads = [
+                ReturnValueThread(target=write_partition, args=(fetcher, partition))
+                for partition, fetcher in enumerate(fetchers)
+            ]
+            for thread in threads:
+                thread.start()
+            failed = sum(thread.join() for thread in threads)
+            assert not failed, f"Failed {failed} partition(s) of spec \"{spec_name}\""
 
         cur.close()
 
@@ -508,10 +1161,20 @@ def process_spec(con, run, spec_name, spec, out_file):
             exec_sql(con, spec['upset'])
 
         con.commit()
+
+        if spec.get('watermark'):
+            # output files are finalized, so save the new high-water mark
+            marks = [fetcher.mark for fetcher in fetchers if fetcher.mark is not None]
+            if marks:
+                logger.info("New watermark %s", max(marks))
+                save_stat(stat, spec_name, watermark=watermark_to_json(max(marks)))
     except:
         logger.exception('EXCEPT')
         con.rollback()
         return_code = 1
+    finally:
+        for fetcher in partition_fetchers:
+            fetcher.close()
     return return_code
 
 
@@ -532,36 +1195,32 @@ class ReturnValueThread(threading.Thread):
         return self.result
 
 
-def worker(list_of_arg_tuples):
+def worker(todo):
     error_count = 0
     connections = dict()
 
-    for arg_tuple in list_of_arg_tuples:
-        run, spec_name, spec, out_file = arg_tuple
+    while True:
+        # take the next spec as soon as this worker is free
+        try:
+            arg_tuple = todo.get_nowait()
+        except queue.Empty:
+            break
+        run, spec_name, spec, out_file, stat = arg_tuple
 
         # get worker connection for the spec
         source_name = spec['source']
         if not connections.get(source_name):
-            source = sources[source_name]
-            connections[source_name] = \
-                source['lib'].connect(source['con_string'], **source.get('con_kwargs', dict())) \
-                if source.get('con_string') else \
-                source['lib'].connect(**source['con_kwargs'])
-            if source.get('setup'):
-                logger.debug('-- setup')
-                exec_sql(connections[source_name], source['setup'])
+            connections[source_name] = connect(sources[source_name])
         con = connections[source_name]
 
         # execute the spec
-        error_count += process_spec(con, run, spec_name, spec, out_file)
+        started = perf_counter()
+        error_count += process_spec(con, run, spec_name, spec, out_file, stat)
+        spec['duration'] = perf_counter() - started
 
     # shutdown all worker connections
     for source_name, con in connections.items():
-        source = sources[source_name]
-        if source.get('upset'):
-            logger.debug('-- upset')
-            exec_sql(con, source['upset'])
-        con.close()
+        disconnect(con, sources[source_name])
 
     return error_count
 
@@ -579,6 +1238,12 @@ def main():
     trace(_ts, 0)
     logger.info(f"run with {PARALLEL_WORKERS} thread(s)")
 
+    if os.path.isfile(STAT_FILE):
+        with open(STAT_FILE, encoding='UTF-8') as f:
+            stat = json.load(f)
+    else:
+        stat = dict()
+
     error_count = 0
     todo = []
     for spec_name, spec in specs.items():
@@ -611,18 +1276,30 @@ def main():
                     src['lib'] = sqlite3
                 else:
                     src['lib'] = None
-            todo.append((run, spec_name, spec, args.out_file))
+            todo.append((run, spec_name, spec, args.out_file, stat))
             #error_count += process(run, spec_name, spec, args.out_file)
 
+    # let worker threads take specs from the shared queue
+    if LONGEST_FIRST:
+        todo.sort(key=lambda arg_tuple: stat.get(arg_tuple[1], {}).get('duration', float('inf')), reverse=True)
+    todo_queue = queue.Queue()
+    for arg_tuple in todo:
+        todo_queue.put(arg_tuple)
+
     # create and start worker threads
     threads = []
     for i in range(PARALLEL_WORKERS):
-        threads.append(ReturnValueThread(target=worker, args=(todo[i::PARALLEL_WORKERS],)))
+        threads.append(ReturnValueThread(target=worker, args=(todo_queue,)))
         threads[-1].start()
     # wait for all worker threads to terminate
     for thread in threads:
         error_count += thread.join()
 
+    for spec_name, spec in specs.items():
+        if spec.get('duration') is not None:
+            stat[spec_name] = dict(stat.get(spec_name, {}), duration=spec['duration'])
+    save_stat(stat)
+
     trace(_ts, 1 if error_count == 0 else 2)
     logger.debug(f"{datetime.now() - _temp}")
     logger.info("-- done %s", f" WITH {error_count} ERRORS" if error_count else '')
@@ -0,0 +1,177 @@
+"""
+File input/output shared by dbang utilities: streaming readers of CSV
+and JSON input files and compression of output files while writing.
+"""
+
+import io
+import csv
+import json
+import itertools
+import logging
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+def naive_csv_reader(file, delimiter):
+    for line in file:
+        yield line.split(delimiter)
+
+
+def arrow_csv_reader(stream, encoding, dialect, delimiter, block_size):
+    """
+    Parse CSV with pyarrow by large blocks in several threads and yield
+    rows as lists of strings, the same as csv.reader does. pyarrow fails
+    on ragged rows, so then the file is read again by csv.reader from
+    the first row not yielded yet.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    naive = dialect == 'naive'
+    if naive:
+        quoting = dict(quote_char=False)
+    else:
+        dialect = csv.get_dialect(dialect)
+        quoting = dict(
+            quote_char=dialect.quotechar or False,
+            double_quote=dialect.doublequote,
+            escape_char=dialect.escapechar or False,
+            newlines_in_values=True
+        )
+
+    def reader(file):
+        if naive:
+            return naive_csv_reader(file, delimiter)
+        return csv.reader(file, dialect=dialect, delimiter=delimiter)
+
+    # count columns by the first row to keep all of them as strings
+    stream = io.BufferedReader(stream, block_size)
+    head = io.StringIO(stream.peek(block_size).decode(encoding, errors='ignore'), newline='')
+    columns = len(next(reader(head), None) or [None])
+
+    count = 0
+    try:
+        for batch in pa_csv.open_csv(
+                stream,
+                read_options=pa_csv.ReadOptions(
+                    encoding=encoding,
+                    block_size=block_size,
+                    autogenerate_column_names=True
+                ),
+                parse_options=pa_csv.ParseOptions(delimiter=delimiter, ignore_empty_lines=False, **quoting),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types={f"f{i}": pa.string() for i in range(columns)},
+                    strings_can_be_null=False,
+                    quoted_strings_can_be_null=False
+                )
+            ):
+            for row in zip(*(column.to_pylist() for column in batch.columns)):
+                count += 1
+                yield list(row)
+    except pa.ArrowInvalid as e:
+        if not stream.seekable():
+            raise
+        logger.debug("%s; reading on from row %s with csv.reader", e, count + 1)
+        stream.seek(0)
+        yield from itertools.islice(reader(io.TextIOWrapper(stream, encoding=encoding)), count, None)
+
+
+def json_reader(file, chunk_size):
+    """
+    Yield elements of JSON array, or values of JSON lines, one by one
+    without loading the whole file into memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    in_array = None
+    separated = True
+    while True:
+        # skip whitespace, reading the file as needed
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = file.read(chunk_size), 0
+            eof = not buf
+        if pos == len(buf):
+            assert not in_array, "Unexpected end of JSON array"
+            return
+        char = buf[pos]
+        if in_array is None:
+            # JSON array or JSON lines?
+            in_array = char == '['
+            if in_array:
+                pos += 1
+                continue
+        if in_array and char == ']':
+            return
+        if in_array and char == ',':
+            assert not separated, f"Unexpected ',' in JSON array: {buf[pos:pos+50]}"
+            separated = True
+            pos += 1
+            continue
+        assert separated, f"Expected ',' in JSON array: {buf[pos:pos+50]}"
+
+        # decode the next value, reading the file until the value is complete
+        # (a number may go on in the next chunk)
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if eof or end < len(buf) and buf[end] in ' \t\r\n,]':
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more = file.read(chunk_size)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+        pos = end
+        separated = not in_array
+        yield value
+
+
+class CompressingFile(io.RawIOBase):
+    """
+    Binary file that compresses data into "zip", "gz" or "zst" while writing.
+    """
+    def __init__(self, filename, compress, arcname):
+        self._file = open(filename, 'wb')
+        self._zip = None
+        self._pos = 0
+        if compress == 'zip':
+            import zipfile
+            self._zip = zipfile.ZipFile(self._file, 'w')
+            member = zipfile.ZipInfo(arcname, datetime.now().timetuple()[:6])
+            member.compress_type = zipfile.ZIP_DEFLATED
+            self._stream = self._zip.open(member, 'w', force_zip64=True)
+        elif compress == 'gz':
+            import gzip
+            self._stream = gzip.GzipFile(arcname, 'wb', fileobj=self._file)
+        elif compress == 'zst':
+            import zstandard
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._file, closefd=False, write_return_read=True)
+        else:
+            assert False, f"Bad compression \"{compress}\""
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        n = self._stream.write(b)
+        self._pos += n
+        return n
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+            if self._zip:
+                self._zip.close()
+            self._file.close()
+        super().close()
@@ -5,15 +5,20 @@ import sys
 import locale
 import re
 import glob
+import io
 import csv
 import json
 import argparse
 import logging
 from datetime import date, datetime
+import queue
 import threading
+from time import perf_counter
 
 from openpyxl import load_workbook
 
+from dio import naive_csv_reader, arrow_csv_reader, json_reader
+
 
 VERSION = '0.4.0'
 
@@ -83,6 +88,8 @@ if not os.path.isdir(IN_DIR):
     sys.exit(1)
 
 PARALLEL_WORKERS = min(getattr(cfg, 'PARALLEL_WORKERS', 1), 8)
+# run specs longest first, by their durations in previous runs
+LONGEST_FIRST = getattr(cfg, 'LONGEST_FIRST', False)
 
 DEBUGGING = getattr(cfg, 'DEBUGGING', False)
 LOGGING = getattr(cfg, 'LOGGING', DEBUGGING)
@@ -117,6 +124,10 @@ ENCODING = getattr(cfg, 'ENCODING', locale.getpreferredencoding())
 
 CSV_DIALECT = getattr(cfg, 'CSV_DIALECT', 'excel')
 CSV_DELIMITER = getattr(cfg, 'CSV_DELIMITER', None) or csv.get_dialect(CSV_DIALECT).delimiter
+# CSV parser: "python" for csv.reader or "pyarrow" to parse by large blocks
+CSV_ENGINE = getattr(cfg, 'CSV_ENGINE', 'python')
+# number of bytes parsed at once by "pyarrow" CSV engine
+CSV_BLOCK_SIZE = 4 * 1024 * 1024
 
 USER_ID = args.user
 STAT_FILE = os.path.join(TEMP_DIR, f".{CFG_MODULE}.json")
@@ -124,7 +135,18 @@ STAT_FILE = os.path.join(TEMP_DIR, f".{CFG_MODULE}.json")
 PRESERVE_N_LOADS = getattr(cfg, 'PRESERVE_N_LOADS', 10)
 PRESERVE_N_TRACES = getattr(cfg, 'PRESERVE_N_TRACES', 10)
 
-BATCH_SIZE = 1000
+# number of rows to insert with one batch
+ONE_BATCH_ROWS = 1000
+# number of rows to insert with one batch, or "auto" to adapt it while inserting
+BATCH_SIZE = getattr(cfg, 'BATCH_SIZE', ONE_BATCH_ROWS)
+# memory limit for one batch when batch size is adapted
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+# number of characters to read from JSON file at once
+JSON_CHUNK_SIZE = 1024 * 1024
+# number of batches read ahead of the inserting thread
+INSERT_QUEUE_SIZE = getattr(cfg, 'INSERT_QUEUE_SIZE', 4)
+# number of batches to commit and record a checkpoint after, 0 - no checkpoints
+CHECKPOINT_BATCHES = getattr(cfg, 'CHECKPOINT_BATCHES', 0)
 
 
 # BEGIN DB SPECIFIC STUFF ######################################################
@@ -433,6 +455,91 @@ create table if not exists ida_lines (
 }
 
 
+# typed staging table of a spec, used instead of ida_lines
+IDA_CREATE_STAGING = {
+    "mssql": """
+if object_id('{table}', 'U') is null
+create table {table} (
+    iload int not null,
+    iline int not null,
+    ntable smallint not null default -1,
+    nline int not null default -1,
+    istat smallint not null default 0,
+    ierrm varchar(4000) null,
+    {columns},
+    primary key (iload, iline, ntable, nline),
+    foreign key (iload) references ida(iload) on delete cascade
+)
+    """,
+    "mysql": """
+create table if not exists {table} (
+    iload int not null,
+    iline int not null,
+    ntable smallint not null default -1,
+    nline int not null default -1,
+    istat smallint not null default 0,
+    ierrm varchar(4000) null,
+    {columns},
+    primary key (iload, iline, ntable, nline),
+    foreign key (iload) references ida(iload) on delete cascade
+)
+    """,
+    "oracle": """
+declare
+    table_exists pls_integer;
+begin
+    select count(*)
+    into table_exists
+    from all_objects
+    where object_name = upper('{table}')
+        and owner = user
+        and object_type in ('TABLE', 'SYNONYM')
+    ;
+    if 0 = table_exists then
+        execute immediate '
+            create table {table} (
+                iload number(9) not null,
+                iline number(9) not null,
+                ntable number(3) default -1 not null,
+                nline number(9) default -1 not null,
+                istat number(1) default 0 not null,
+                ierrm varchar2(4000),
+                {columns},
+                primary key (iload, iline, ntable, nline),
+                foreign key (iload) references ida(iload) on delete cascade
+            )';
+    end if;
+end;
+    """,
+    "postgresql": """
+create table if not exists {table} (
+    iload int not null,
+    iline int not null,
+    ntable smallint not null default -1,
+    nline int not null default -1,
+    istat smallint not null default 0,
+    ierrm varchar(4000),
+    {columns},
+    primary key (iload, iline, ntable, nline),
+    foreign key (iload) references ida(iload) on delete cascade
+)
+    """,
+    "sqlite": """
+create table if not exists {table} (
+    iload int not null,
+    iline int not null,
+    ntable smallint not null default -1,
+    nline int not null default -1,
+    istat smallint not null default 0,
+    ierrm varchar(4000),
+    {columns},
+    primary key (iload, iline, ntable, nline),
+    foreign key (iload) references ida(iload) on delete cascade
+)
+    """,
+}
+
+
 def ida_insert_header_mssql(cur, user_id, filename, spec_name, load_args):
     insert_stmt = \
         """
@@ -528,7 +635,7 @@ IDA_INSERT_HEADER = {
 }
 
 IDA_INSERT_ROW = """
-insert into ida_lines (
+insert into {table} (
     iload, iline, {cols}
 ) values (
     {vals}
@@ -536,39 +643,44 @@ insert into ida_lines (
 """
 IDA_BUILD_INSERT_ROW = {
     "mssql": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROW.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 2)),
+                table=table,
+                cols=','.join(columns[:len(row) - 2] if columns else (f"c{i+1}" for i in range(len(row) - 2))),
                 vals=','.join('?' for i in range(len(row)))
             ),
     "mysql": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROW.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 2)),
+                table=table,
+                cols=','.join(columns[:len(row) - 2] if columns else (f"c{i+1}" for i in range(len(row) - 2))),
                 vals=','.join('%s' for i in range(len(row)))
             ),
     "oracle": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROW.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 2)),
+                table=table,
+                cols=','.join(columns[:len(row) - 2] if columns else (f"c{i+1}" for i in range(len(row) - 2))),
                 vals=','.join(f":{i+1}" for i in range(len(row)))
             ),
     "postgresql": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROW.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 2)),
+                table=table,
+                cols=','.join(columns[:len(row) - 2] if columns else (f"c{i+1}" for i in range(len(row) - 2))),
                 vals=','.join('%s' for i in range(len(row)))
             ),
     "sqlite": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROW.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 2)),
+                table=table,
+                cols=','.join(columns[:len(row) - 2] if columns else (f"c{i+1}" for i in range(len(row) - 2))),
                 vals=','.join('?' for i in range(len(row)))
             ),
 }
 
 IDA_INSERT_ROWS = """
-insert into ida_lines (
+insert into {table} (
     iload, iline, ntable, nline, {cols}
 ) values (
     {vals}
@@ -576,33 +688,38 @@ insert into ida_lines (
 """
 IDA_BUILD_INSERT_ROWS = {
     "mssql": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROWS.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 4)),
+                table=table,
+                cols=','.join(columns[:len(row) - 4] if columns else (f"c{i+1}" for i in range(len(row) - 4))),
                 vals=','.join('?' for i in range(len(row)))
             ),
     "mysql": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROWS.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 4)),
+                table=table,
+                cols=','.join(columns[:len(row) - 4] if columns else (f"c{i+1}" for i in range(len(row) - 4))),
                 vals=','.join('%s' for i in range(len(row)))
             ),
     "oracle": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROWS.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 4)),
+                table=table,
+                cols=','.join(columns[:len(row) - 4] if columns else (f"c{i+1}" for i in range(len(row) - 4))),
                 vals=','.join(f":{i+1}" for i in range(len(row)))
             ),
     "postgresql": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROWS.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 4)),
+                table=table,
+                cols=','.join(columns[:len(row) - 4] if columns else (f"c{i+1}" for i in range(len(row) - 4))),
                 vals=','.join('%s' for i in range(len(row)))
             ),
     "sqlite": \
-        lambda row:
+        lambda row, table='ida_lines', columns=None:
             IDA_INSERT_ROWS.format(
-                cols=','.join(f"c{i+1}" for i in range(len(row) - 4)),
+                table=table,
+                cols=','.join(columns[:len(row) - 4] if columns else (f"c{i+1}" for i in range(len(row) - 4))),
                 vals=','.join('?' for i in range(len(row)))
             ),
 }
@@ -611,29 +728,97 @@ IDA_BUILD_INSERT_ROWS = {
 def ida_insert_many_rows_anydb(cur, stmt, rows):
     cur.executemany(stmt, rows)
 
+# Bulk paths below apply to statements built by IDA_BUILD_INSERT_ROW(S) only,
+# statements from "insert_actions" are executed as is.
+IDA_INSERT_STMT = re.compile(r'^\s*insert into (\w+) \(\s*(iload, iline, .+?)\s*\) values \(\s*(.+?)\s*\)\s*$', re.S)
+
+def ida_insert_many_rows_multi_values(cur, stmt, rows, max_rows, max_params):
+    match = IDA_INSERT_STMT.match(stmt)
+    if not match:
+        return ida_insert_many_rows_anydb(cur, stmt, rows)
+    table, cols, vals = match.groups()
+    chunk = max(1, min(max_rows, max_params // len(rows[0])))
+    for i in range(0, len(rows), chunk):
+        chunk_rows = rows[i:i+chunk]
+        cur.execute(
+            f"insert into {table} ({cols}) values " + ','.join(f"({vals})" for row in chunk_rows),
+            [value for row in chunk_rows for value in row]
+        )
+
+def ida_insert_many_rows_mssql(cur, stmt, rows):
+    # SQL Server allows up to 1000 rows in VALUES and 2100 parameters per statement
+    ida_insert_many_rows_multi_values(cur, stmt, rows, 1000, 2099)
+
+def ida_insert_many_rows_mysql(cur, stmt, rows):
+    # max_allowed_packet is the limit, so keep statements moderately sized
+    ida_insert_many_rows_multi_values(cur, stmt, rows, 1000, 65535)
+
+class BatchErrors(Exception):
+    """
+    Some rows of a batch failed to insert while the other rows got inserted;
+    errors are (offset of the row in the batch, error message) pairs.
+    """
+    def __init__(self, errors, rows):
+        self.errors = errors
+        super().__init__(
+            f"{len(errors)} of {rows} rows failed to insert, first at offset {errors[0][0]}: {errors[0][1]}"
+        )
+
+def ida_insert_many_rows_oracle(cur, stmt, rows):
+    cur.executemany(stmt, rows, batcherrors=True)
+    errors = cur.getbatcherrors()
+    if errors:
+        raise BatchErrors([(error.offset, error.message) for error in errors], len(rows))
+
+def ida_insert_many_rows_postgresql(cur, stmt, rows):
+    match = IDA_INSERT_STMT.match(stmt)
+    if not match:
+        return ida_insert_many_rows_anydb(cur, stmt, rows)
+    table, cols, vals = match.groups()
+    with cur.copy(f"copy {table} ({cols}) from stdin") as copy:
+        for row in rows:
+            copy.write_row(row)
+
 IDA_INSERT_MANY_ROWS = {
-    "mssql": ida_insert_many_rows_anydb,
-    "mysql": ida_insert_many_rows_anydb,
-    "oracle": ida_insert_many_rows_anydb,
-    "postgresql": ida_insert_many_rows_anydb,
+    "mssql": ida_insert_many_rows_mssql,
+    "mysql": ida_insert_many_rows_mysql,
+    "oracle": ida_insert_many_rows_oracle,
+    "postgresql": ida_insert_many_rows_postgresql,
+    # sqlite3 runs executemany in the implicit transaction committed per file
     "sqlite": ida_insert_many_rows_anydb,
 }
 
+# statements to set, roll back to and release a savepoint around a batch of rows
+# when bad rows are skipped; savepoints left unreleased go away on commit
+IDA_SAVEPOINT = {
+    "mssql": ("save transaction ida_batch", "rollback transaction ida_batch", None),
+    "mysql": ("savepoint ida_batch", "rollback to savepoint ida_batch", "release savepoint ida_batch"),
+    "oracle": ("savepoint ida_batch", "rollback to savepoint ida_batch", None),
+    "postgresql": ("savepoint ida_batch", "rollback to savepoint ida_batch", "release savepoint ida_batch"),
+    # releasing the outermost savepoint would commit the transaction
+    "sqlite": ("savepoint ida_batch", "rollback to savepoint ida_batch", None),
+}
+
+# bad rows skipped while loading are recorded into ida_lines with
+# ntable = IDA_BAD_NTABLE - <number of the insert statement>,
+# so that validation does not count them
+IDA_BAD_NTABLE = -2
+
 IDA_SELECT_ISTAT_2_COUNT = {
     "mssql": """
-select count(*) from ida_lines where iload = ? and istat = 2
+select count(*) from {table} where iload = ? and istat = 2 and ntable > {bad_ntable}
     """,
     "mysql": """
-select count(*) from ida_lines where iload = %s and istat = 2
+select count(*) from {table} where iload = %s and istat = 2 and ntable > {bad_ntable}
     """,
     "oracle": """
-select count(*) from ida_lines where iload = :iload and istat = 2
+select count(*) from {table} where iload = :iload and istat = 2 and ntable > {bad_ntable}
     """,
     "postgresql": """
-select count(*) from ida_lines where iload = %s and istat = 2
+select count(*) from {table} where iload = %s and istat = 2 and ntable > {bad_ntable}
     """,
     "sqlite": """
-select count(*) from ida_lines where iload = ? and istat = 2
+select count(*) from {table} where iload = ? and istat = 2 and ntable > {bad_ntable}
     """,
 }
 IDA_SELECT_ISTAT_IMESS = {
@@ -755,6 +940,34 @@ def connection(src):
     return sources[src]['con']
 
 
+def connect(source):
+    """
+    Connect to DB source and setup the session.
+    """
+    con_kwargs = source.get('con_kwargs', dict())
+    if source['database'] == 'sqlite':
+        # the connection is shared with the inserting thread
+        con_kwargs = dict({'check_same_thread': False}, **con_kwargs)
+    con = \
+        source['lib'].connect(source['con_string'], **con_kwargs) \
+        if source.get('con_string') else \
+        source['lib'].connect(**con_kwargs)
+    if source.get('setup'):
+        logger.debug('-- setup')
+        exec_sql(con, source['setup'])
+    return con
+
+
+def disconnect(con, source):
+    """
+    Release the session and close connection to DB source.
+    """
+    if source.get('upset'):
+        logger.debug('-- upset')
+        exec_sql(con, source['upset'])
+    con.close()
+
+
 def trace(ts, status):
     """
     Create or rename trace file to show current status.
@@ -783,14 +996,268 @@ def trace(ts, status):
     logger.debug("trace %s", this_trace + str(status))
 
 
-def naive_csv_reader(file, csv_delimiter):
-    for line in file:
-        yield line.split(csv_delimiter)
+def insert_data_caller(func, text_lines=False):
+    """
+    Resolve calling convention of insert_data function once per spec.
+    Return function of (iload, count, line_no, row).
+    """
+    if func is None:
+        if text_lines:
+            return lambda iload, count, line_no, row: [row]
+        return lambda iload, count, line_no, row: row
+    argcount = func.__code__.co_argcount
+    if argcount == 1:
+        return lambda iload, count, line_no, row: func(row)
+    if argcount == 2:
+        return lambda iload, count, line_no, row: func(line_no, row)
+    if argcount == 3:
+        return lambda iload, count, line_no, row: func(iload, count, row)
+    assert False, f"Expected 1 to 3 arguments of \"insert_data\" function, got {argcount}"
+
+
+def insert_data_batch_caller(func):
+    """
+    Resolve calling convention of batch insert_data function once per spec.
+    Return function of (ilines, rows) that returns the rows to insert and
+    their numbers of loaded lines, or None if the function does not tell them.
+    """
+    if func is None:
+        return lambda ilines, rows: (rows, ilines)
+    argcount = func.__code__.co_argcount
+    if argcount == 1:
+        return lambda ilines, rows: (func(rows), None)
+    if argcount == 2:
+        def call(ilines, rows):
+            # every row returned starts with the number of its loaded line
+            irows = func(ilines, rows) or []
+            return [irow[1:] for irow in irows], [irow[0] for irow in irows]
+        return call
+    assert False, f"Expected 1 or 2 arguments of batch \"insert_data\" function, got {argcount}"
+
+
+def open_input(ifile, spec_name, spec):
+    """
+    Open input file as a binary stream; the only member of zip file and
+    gz or zst compressed file are decompressed while being read.
+    Return the stream, the name and the format of the data.
+    """
+    ifile_name = os.path.basename(ifile)
+    file_ext = ifile_name.rsplit('.', 1)[-1]
+    if file_ext == 'zip':
+        import zipfile
+        with zipfile.ZipFile(ifile) as zf:
+            inner_file = zf.namelist()
+            assert len(inner_file) == 1, \
+                f"More than 1 member in file {ifile}"
+            inner_file = inner_file[0]
+            assert os.path.basename(inner_file) == inner_file, \
+                f"Zip file member has path in file {ifile}"
+            inner_name, inner_ext = inner_file.rsplit('.', 1)
+            assert ifile_name.rsplit('.', 1)[0] in (inner_file, inner_name), \
+                f"Zip file member name is inconsistent with file name {ifile}"
+            assert inner_ext in ('csv', 'json', 'xlsx') or spec.get('text_lines', False), \
+                f"Zip file member has bad extension \"{inner_ext}\" in file {ifile}"
+            assert inner_ext != 'json' or spec.get('insert_data'), \
+                f"Missing \"insert_data\" in spec \"{spec_name}\""
+            # the member stays readable after the archive is closed
+            return zf.open(inner_file), inner_file, inner_ext
+    elif file_ext in ('gz', 'zst'):
+        inner_file = ifile_name.rsplit('.', 1)[0]
+        inner_ext = inner_file.rsplit('.', 1)[-1]
+        assert inner_ext in ('csv', 'json', 'xlsx') or spec.get('text_lines', False), \
+            f"Compressed file has bad extension \"{inner_ext}\" in file {ifile}"
+        assert inner_ext != 'json' or spec.get('insert_data'), \
+            f"Missing \"insert_data\" in spec \"{spec_name}\""
+        if file_ext == 'gz':
+            import gzip
+            return gzip.open(ifile, 'rb'), inner_file, inner_ext
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(ifile, 'rb'), closefd=True), inner_file, inner_ext
+    return open(ifile, 'rb'), ifile_name, file_ext
+
+
+class Inserter:
+    """
+    Insert batches of rows in a separate thread while the caller goes on
+    reading the input file and preparing the next batches of fixed or
+    adaptive ("auto") size.
+    """
+    def __init__(self, source, con, batch_size=BATCH_SIZE, skip_bad_rows=False):
+        assert batch_size == 'auto' or (isinstance(batch_size, int) and batch_size > 0), \
+            f"Bad \"batch_size\": {batch_size}"
+        self.insert_many_rows = IDA_INSERT_MANY_ROWS[source['database']]
+        self.savepoint = IDA_SAVEPOINT[source['database']] if skip_bad_rows else None
+        self.bad_rows = []
+        self.cur = con.cursor()
+        self._adaptive = batch_size == 'auto'
+        self._throughput = 0
+        self.rows = ONE_BATCH_ROWS if self._adaptive else batch_size
+        self.batches = queue.Queue(maxsize=INSERT_QUEUE_SIZE)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._insert, daemon=True)
+        self.thread.start()
+
+    def _insert(self):
+        while True:
+            batch = self.batches.get()
+            try:
+                if batch is None:
+                    return
+                # skip the rest of batches after an error or on close
+                if not self.error and not self.closed:
+                    t = perf_counter()
+                    if self.savepoint:
+                        self._insert_bisecting(*batch)
+                    else:
+                        self.insert_many_rows(self.cur, *batch[1:3])
+                    t = perf_counter() - t
+                    if self._adaptive and len(batch[2]) >= self.rows:
+                        self._adapt(batch[2], t)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.batches.task_done()
+
+    def _insert_bisecting(self, n, stmt, rows, lines):
+        """
+        Insert rows; if it fails, bisect rows to insert the good ones and
+        collect the bad ones along with the number of the statement, their
+        line numbers and errors. Bad rows the driver reports by BatchErrors
+        are collected without bisecting.
+        """
+        savepoint, rollback, release = self.savepoint
+        self.cur.execute(savepoint)
+        try:
+            self.insert_many_rows(self.cur, stmt, rows)
+        except BatchErrors as e:
+            # the good rows are inserted already, and the bad ones are known
+            for offset, message in e.errors:
+                self.bad_rows.append((n, stmt, rows[offset], lines[offset] if lines else None, message))
+        except Exception as e:
+            self.cur.execute(rollback)
+            if len(rows) == 1:
+                self.bad_rows.append((n, stmt, rows[0], lines[0] if lines else None, str(e)))
+                return
+            half = len(rows) // 2
+            self._insert_bisecting(n, stmt, rows[:half], lines and lines[:half])
+            self._insert_bisecting(n, stmt, rows[half:], lines and lines[half:])
+            return
+        if release:
+            self.cur.execute(release)
+
+    def _adapt(self, rows, seconds):
+        throughput = len(rows) / max(seconds, 1e-6)
+        row_bytes = sum(sys.getsizeof(f) for f in rows[0]) or 1
+        max_rows = max(100, MAX_BATCH_BYTES // row_bytes)
+        if self.rows > max_rows:
+            # rows are too wide to insert that many at once
+            self.rows = max_rows
+        elif throughput > self._throughput * 1.1:
+            # bigger batch still pays off
+            self.rows = min(self.rows * 2, max_rows)
+            self._throughput = throughput
+        elif throughput < self._throughput * 0.9:
+            # bigger batch does not pay off, step back and stay there
+            self.rows = max(self.rows // 2, 100)
+            self._adaptive = False
+        else:
+            self._adaptive = False
+        if not self._adaptive:
+            logger.debug("insert %s rows at once", self.rows)
+
+    def insert(self, n, stmt, rows, lines=None):
+        """
+        Queue rows to be inserted with stmt number n; the rows list is owned
+        by the inserter. Optional lines are numbers of input lines of the rows
+        to report bad rows.
+        """
+        if self.error:
+            raise self.error
+        self.batches.put((n, stmt, rows, lines))
+
+    def wait(self):
+        """
+        Wait until all queued rows are inserted, e.g. before commit.
+        """
+        self.batches.join()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.batches.put(None)
+        self.thread.join()
+        self.cur.close()
+
+
+def insert_bad_rows(cur, source, iload, bad_rows, first=1):
+    """
+    Record rows that failed to insert into table ida_lines with istat = 2
+    and the error message, numbering them with negative nline.
+    """
+    for k, (n, stmt, row, line, errm) in enumerate(bad_rows, start=first):
+        match = IDA_INSERT_STMT.match(stmt)
+        if match:
+            # row of ida_lines or of a staging table
+            line = row[1]
+            row = row[4:] if match.group(2).startswith('iload, iline, ntable, nline,') else row[2:]
+        elif isinstance(row, dict):
+            row = list(row.values())
+        bad_row = (
+            iload, line or 0, IDA_BAD_NTABLE - n, -k, 2, errm[:4000],
+            *(None if value is None else str(value)[:4000] for value in row[:100])
+        )
+        stmt = IDA_BUILD_INSERT_ROWS[source['database']](bad_row, 'ida_lines', ['istat', 'ierrm'] + [f"c{i+1}" for i in range(100)])
+        cur.execute(stmt, bad_row)
+    return len(bad_rows)
+
+
+def checkpoint_file(spec_name):
+    spec_name = re.sub(r'[^\w.-]', '_', spec_name)
+    return os.path.join(TEMP_DIR, f".{CFG_MODULE}.{spec_name}.checkpoint.json")
 
 
-def do_actions(spec, source, con, cur, iload):
+def read_checkpoint(spec_name, target_files, rows_per_load):
+    """
+    Read checkpoint of the spec's load interrupted before, if it still
+    matches the files to load.
+    """
+    if not os.path.isfile(checkpoint_file(spec_name)):
+        return None
+    with open(checkpoint_file(spec_name), encoding='UTF-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint['rows_per_load'] != rows_per_load \
+            or checkpoint['file'] and (
+                checkpoint['file'] not in target_files
+                or os.stat(checkpoint['file']).st_mtime != checkpoint['mtime']
+            ):
+        logger.info("Ignoring outdated checkpoint of iload=%s", checkpoint['iload'])
+        return None
+    return checkpoint
+
+
+def write_checkpoint(spec_name, checkpoint):
+    # replace the file at once, so that a crash leaves the previous checkpoint
+    with open(checkpoint_file(spec_name) + '.tmp', 'w', encoding='UTF-8') as f:
+        f.write(json.dumps(checkpoint))
+    os.replace(checkpoint_file(spec_name) + '.tmp', checkpoint_file(spec_name))
+
+
+def staging_table(spec):
+    """
+    Get name of the table to load lines into.
+    """
+    return spec['staging']['table'] if spec.get('staging') else 'ida_lines'
+
+
+def do_actions(spec, source, con, cur, iload, bad_count=0):
     """
     Dо validate_ and process_actions.
+    Bad rows skipped while loading do not stop processing of the good ones
+    but fail the load.
     """
     err_count = 0
 
@@ -804,7 +1271,7 @@ def do_actions(spec, source, con, cur, iload):
         con.commit()
 
         if spec.get('insert_actions') is None:
-            cur.execute(IDA_SELECT_ISTAT_2_COUNT[source['database']], (iload,))
+            cur.execute(IDA_SELECT_ISTAT_2_COUNT[source['database']].format(table=staging_table(spec), bad_ntable=IDA_BAD_NTABLE), (iload,))
             err_count = cur.fetchone()
             err_count = err_count[0] if err_count else 0
             if err_count > 0:
@@ -830,7 +1297,7 @@ def do_actions(spec, source, con, cur, iload):
         con.commit()
 
         if spec.get('insert_actions') is None:
-            cur.execute(IDA_SELECT_ISTAT_2_COUNT[source['database']], (iload,))
+            cur.execute(IDA_SELECT_ISTAT_2_COUNT[source['database']].format(table=staging_table(spec), bad_ntable=IDA_BAD_NTABLE), (iload,))
             err_count = cur.fetchone()
             err_count = err_count[0] if err_count else 0
             if err_count > 0:
@@ -846,12 +1313,356 @@ def do_actions(spec, source, con, cur, iload):
             else:
                 logger.info("Processing succeeded")
 
+    if bad_count > 0:
+        logger.warning("Load iload=%s failed: skipped %s bad rows, see ida_lines with istat=2", iload, bad_count)
+        err_count += bad_count
+
     # mark as failed or succeeded
-    if spec.get('validate_actions') or spec.get('process_actions'):
+    if spec.get('validate_actions') or spec.get('process_actions') or bad_count > 0:
         cur.execute(IDA_UPDATE_ISTAT[source['database']], (2 if err_count > 0 else 1, iload,))
         con.commit()
 
 
+def load_files(con, spec_name, spec, target_files, filename, file_ext, load_args, checkpoints=False):
+    """
+    Load data from target files into database.
+    With checkpoints, commit every N batches and record the committed line
+    of the file, so that a restarted run resumes an interrupted load.
+    """
+    source = sources[spec['source']]
+    rows_per_load = spec.get('rows_per_load', 0)
+    checkpoint_batches = spec.get('checkpoint_batches', CHECKPOINT_BATCHES) if checkpoints else 0
+    if checkpoint_batches and args.force and os.path.isfile(checkpoint_file(spec_name)):
+        # --force loads the files from scratch
+        logger.info("Removing checkpoint of the interrupted load, --force")
+        os.remove(checkpoint_file(spec_name))
+    checkpoint = read_checkpoint(spec_name, target_files, rows_per_load) if checkpoint_batches else None
+    staging = (spec['staging']['table'], list(spec['staging']['columns'])) if spec.get('staging') else ()
+    insert_batch = spec.get('insert_data_batch', False)
+    insert_data = [
+        insert_data_batch_caller(func) if insert_batch else insert_data_caller(func, spec.get('text_lines', False))
+        for func in spec.get('insert_data', [None])
+    ]
+    insert_actions = spec.get('insert_actions') or [None for func in insert_data]
+    skip_bad_rows = spec.get('skip_bad_rows', False)
+    # whether insert_data functions return many rows, found out by the first returned data
+    nested = [None for func in insert_data]
+
+    def prepare_batch(n, irows, lines):
+        # rows returned for a batch keep the numbers of their loaded lines
+        # if the function tells them, otherwise they are numbered through
+        # the load; rows of several functions are told apart by ntable
+        if not irows:
+            return
+        if insert_actions[n]:
+            idata[n].extend(irows)
+            if skip_bad_rows:
+                ilines[n].extend(lines or [count] * len(irows))
+            return
+        if lines is None:
+            first = icount[n] + len(idata[n]) + 1
+            if len(insert_data) == 1:
+                idata[n].extend([(iload, first + i, *irow) for i, irow in enumerate(irows)])
+            else:
+                idata[n].extend([(iload, count, n, first + i, *irow) for i, irow in enumerate(irows)])
+        elif len(insert_data) == 1:
+            idata[n].extend([(iload, line, *irow) for line, irow in zip(lines, irows)])
+        else:
+            # rows of the same line are numbered from 1, as with row by row functions
+            k, prev = 0, None
+            for line, irow in zip(lines, irows):
+                k, prev = (k + 1 if line == prev else 1), line
+                idata[n].append((iload, line, n, k, *irow))
+        if not istmt[n]:
+            build = IDA_BUILD_INSERT_ROW if len(insert_data) == 1 else IDA_BUILD_INSERT_ROWS
+            istmt[n] = build[source['database']](idata[n][-1], *staging)
+            logger.debug("-- stmt #%s\n\n%s\n", n, istmt[n].strip())
+
+    def flush():
+        # insert all prepared data and wait for it to be inserted
+        for n in range(len(idata)):
+            if idata[n]:
+                inserter.insert(n, istmt[n], idata[n], ilines[n])
+                icount[n] += len(idata[n])
+                idata[n] = []
+                ilines[n] = []
+        inserter.wait()
+        if inserter.bad_rows:
+            logger.info("Skipped %s bad rows, see ida_lines with iload=%s and istat=2", len(inserter.bad_rows), iload)
+            insert_bad_rows(cur, source, iload, inserter.bad_rows, sum(ibad) + 1)
+            for bad_row in inserter.bad_rows:
+                ibad[bad_row[0]] += 1
+            inserter.bad_rows = []
+
+    cur = None
+    inserter = None
+    file = None
+    wb = None
+    try:
+        cur = con.cursor()
+        inserter = Inserter(source, con, spec.get('batch_size', source.get('batch_size', BATCH_SIZE)), skip_bad_rows)
+        count = 0
+        idata = []
+        ilines = []
+        icount = []
+        ibad = []
+        iload = None
+        istmt = []
+        nbatches = 0
+        done = {}
+        if checkpoint:
+            done = checkpoint['done']
+            if rows_per_load == 0:
+                # go on with the interrupted load
+                iload, count, icount, ibad = checkpoint['iload'], checkpoint['count'], checkpoint['icount'], checkpoint['ibad']
+                idata = [[] for func in insert_data]
+                ilines = [[] for func in insert_data]
+                istmt = list(insert_actions)
+                logger.info("Resuming iload=%s", iload)
+        for ifile in target_files:
+            if done.get(ifile) == os.stat(ifile).st_mtime:
+                logger.info("%s - loaded before the restart", ifile)
+                continue
+
+            # open file for reading
+            stream, iname, in_format = open_input(ifile, spec_name, spec)
+            if in_format == 'xlsx' and not spec.get('text_lines', False):
+                if in_format != file_ext:
+                    # openpyxl seeks all over the workbook, so decompress it into memory
+                    with stream:
+                        stream = io.BytesIO(stream.read())
+                file = stream
+                wb = load_workbook(filename=file, read_only=True)
+                #reader = wb.worksheets[0]
+                reader = wb.worksheets[0].values
+            elif in_format == 'csv' and spec.get('csv_engine', CSV_ENGINE) == 'pyarrow' and not spec.get('text_lines', False):
+                file = stream
+                reader = \
+                    arrow_csv_reader(
+                        file,
+                        encoding=spec.get('encoding', ENCODING),
+                        dialect=spec.get('csv_dialect', CSV_DIALECT),
+                        delimiter=spec.get('csv_delimiter', CSV_DELIMITER),
+                        block_size=CSV_BLOCK_SIZE
+                    )
+            else:
+                file = io.TextIOWrapper(stream, encoding=spec.get('encoding', ENCODING))
+                if spec.get('text_lines', False):
+                    reader = file
+                elif in_format == 'csv':
+                    if spec.get('csv_dialect', CSV_DIALECT) == 'naive':
+                        reader = \
+                            naive_csv_reader(
+                                file,
+                                delimiter=spec.get('csv_delimiter', CSV_DELIMITER)
+                            )
+                    else:
+                        reader = \
+                            csv.reader(
+                                file,
+                                dialect=spec.get('csv_dialect', CSV_DIALECT),
+                                delimiter=spec.get('csv_delimiter', CSV_DELIMITER)
+                                #quotechar=spec.get('csv_quotechar', CSV_QUOTECHAR)
+                            )
+                elif in_format == 'json':
+                    reader = json_reader(file, JSON_CHUNK_SIZE)
+
+            # load data from file
+            if rows_per_load == -1:
+                # rows of each input file go to a separate load
+                count = 0
+                idata = []
+                ilines = []
+                icount = []
+                ibad = []
+                iload = None
+                istmt = []
+            skip_to = 0
+            if checkpoint and ifile == checkpoint['file']:
+                if rows_per_load == -1:
+                    # go on with the interrupted load
+                    iload, count, icount, ibad = checkpoint['iload'], checkpoint['count'], checkpoint['icount'], checkpoint['ibad']
+                    idata = [[] for func in insert_data]
+                    ilines = [[] for func in insert_data]
+                    istmt = list(insert_actions)
+                    logger.info("Resuming iload=%s", iload)
+                skip_to = checkpoint['line']
+                logger.info("%s - skipping %s lines loaded before the restart", ifile, skip_to)
+            line_no = 0
+            batch = []
+            blines = []
+            for row in reader:
+                if line_no < skip_to:
+                    line_no += 1
+                    continue
+
+                # create header in table ida
+                if not iload:
+                    file_ = filename if rows_per_load != -1 else iname
+                    iload = IDA_INSERT_HEADER[source['database']](cur, USER_ID, file_, spec_name, load_args or [None])
+                    con.commit()
+                    idata = [[] for func in insert_data]
+                    ilines = [[] for func in insert_data]
+                    icount = [0 for func in insert_data]
+                    ibad = [0 for func in insert_data]
+                    istmt = list(insert_actions)
+                    for n, stmt in enumerate(istmt):
+                        if stmt:
+                            logger.debug("-- stmt #%s\n\n%s\n", n, stmt.strip())
+
+                count += 1
+                line_no += 1
+                if line_no <= spec.get('skip_lines', 0):
+                    continue
+
+                if insert_batch:
+                    # rows are transformed by batches below
+                    batch.append(row)
+                    blines.append(count)
+                    if len(batch) < inserter.rows:
+                        continue
+
+                # prepare data to insert
+                for n, func in enumerate(insert_data):
+                    if insert_batch:
+                        prepare_batch(n, *func(blines, batch))
+                        continue
+                    irows = func(iload, count, line_no, row)
+                    if not irows:
+                        # insert no row
+                        continue
+                    assert isinstance(irows, (list, tuple)), \
+                        f"Expected list or tuple from \"insert_data\" #{n}, got {type(irows).__name__}"
+                    if nested[n] is None:
+                        nested[n] = isinstance(irows[0], (list, tuple))
+                    else:
+                        assert nested[n] == isinstance(irows[0], (list, tuple)), \
+                            f"Expected {'many rows' if nested[n] else 'a row'} from \"insert_data\" #{n} as before, line {count}"
+                    if not nested[n]:
+                        # insert a row
+                        if insert_actions[n]:
+                            idata[n].append(irows)
+                            if skip_bad_rows:
+                                ilines[n].append(count)
+                        else:
+                            idata[n].append((iload, count, *irows))
+                            if not istmt[n]:
+                                istmt[n] = IDA_BUILD_INSERT_ROW[source['database']](idata[n][-1], *staging)
+                                logger.debug("-- stmt #%s\n\n%s\n", n, istmt[n].strip())
+                    else:
+                        # insert many rows
+                        if insert_actions[n]:
+                            idata[n].extend(irows)
+                            if skip_bad_rows:
+                                ilines[n].extend([count] * len(irows))
+                        else:
+                            idata[n].extend([(iload, count, n, i+1, *irow) for i, irow in enumerate(irows)])
+                            if not istmt[n]:
+                                istmt[n] = IDA_BUILD_INSERT_ROWS[source['database']](idata[n][-1], *staging)
+                                logger.debug("-- stmt #%s\n\n%s\n", n, istmt[n].strip())
+                batch = []
+                blines = []
+
+                # insert prepared data
+                for n in range(len(idata)):
+                    if len(idata[n]) >= inserter.rows:
+                        inserter.insert(n, istmt[n], idata[n], ilines[n])
+                        icount[n] += len(idata[n])
+                        idata[n] = []
+                        ilines[n] = []
+                        nbatches += 1
+
+                # commit and record the line to resume from
+                if checkpoint_batches and nbatches >= checkpoint_batches:
+                    flush()
+                    con.commit()
+                    write_checkpoint(spec_name, {
+                        "rows_per_load": rows_per_load, "done": done,
+                        "file": ifile, "mtime": os.stat(ifile).st_mtime, "line": line_no,
+                        "iload": iload, "count": count, "icount": icount, "ibad": ibad
+                    })
+                    logger.debug("checkpoint at line %s", line_no)
+                    nbatches = 0
+
+            if wb:
+                wb.close()
+                wb = None
+            file.close()
+
+            # transform the rest of rows of the file
+            if batch:
+                for n, func in enumerate(insert_data):
+                    prepare_batch(n, *func(blines, batch))
+
+            # insert the rest of prepared data before removing the file
+            flush()
+
+            logger.info("%s", ifile)
+            if rows_per_load == -1:
+                logger.info("Loaded %s of %s rows with iload=%s", str([c - b for c, b in zip(icount, ibad)]).strip('[]'), count - spec.get('skip_lines', 0), iload)
+                # Do the spec's validate_ and process_actions.
+                do_actions(spec, source, con, cur, iload, sum(ibad))
+            con.commit()
+            if checkpoint_batches:
+                done[ifile] = os.stat(ifile).st_mtime
+                write_checkpoint(spec_name, {
+                    "rows_per_load": rows_per_load, "done": done,
+                    "file": None, "mtime": None, "line": 0,
+                    "iload": iload, "count": count, "icount": icount, "ibad": ibad
+                })
+                nbatches = 0
+
+            if args.delete or spec.get('delete'):
+                os.remove(ifile)
+
+        if rows_per_load == 0:
+            logger.info("Loaded %s of %s rows with iload=%s", str([c - b for c, b in zip(icount, ibad)]).strip('[]'), count - spec.get('skip_lines', 0), iload)
+            # Do the spec's validate_ and process_actions.
+            do_actions(spec, source, con, cur, iload, sum(ibad))
+        if checkpoint_batches and os.path.isfile(checkpoint_file(spec_name)):
+            # the load is complete
+            os.remove(checkpoint_file(spec_name))
+    finally:
+        if inserter:
+            inserter.close()
+        if file:
+            file.close()
+        if wb:
+            wb.close()
+        if cur:
+            cur.close()
+
+
+def load_files_worker(spec_name, spec, files, filename, file_ext, load_args):
+    """
+    Load files taken from the shared queue on a separate connection.
+    The spec's setup and upset are done by the caller.
+    """
+    source = sources[spec['source']]
+    error_count = 0
+    con = None
+    try:
+        con = connect(source)
+        while True:
+            try:
+                ifile = files.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                load_files(con, spec_name, spec, [ifile], filename, file_ext, load_args)
+            except:
+                logger.exception('EXCEPT')
+                con.rollback()
+                error_count += 1
+    except:
+        logger.exception('EXCEPT')
+        error_count += 1
+    finally:
+        if con:
+            disconnect(con, source)
+    return error_count
+
+
 def process_spec(con, spec_name, spec, input_file, stat):
     """
     Process spec from config-file.
@@ -875,8 +1686,6 @@ def process_spec(con, spec_name, spec, input_file, stat):
     rows_per_load = spec.get('rows_per_load', 0)
 
     cur = None
-    file = None
-    wb = None
     try:
         # normalize the spec
         if isinstance(spec.get('insert_actions'), str):
@@ -889,18 +1698,26 @@ def process_spec(con, spec_name, spec, input_file, stat):
             spec['process_actions'] = [spec['process_actions']]
 
         # validate the spec
-        assert file_ext in ('csv', 'xlsx', 'json', 'zip') or spec.get('text_lines', False), \
+        assert file_ext in ('csv', 'xlsx', 'json', 'zip', 'gz', 'zst') or spec.get('text_lines', False), \
             f"Bad file extension \"{file_ext}\" in spec \"{spec_name}\""
         #assert sources.get(spec['source']), \
         #    f"Source \"{spec['source']}\" not defined, spec \"{spec_name}\""
         assert file_ext != 'json' or spec.get('insert_data'), \
             f"Missing \"insert_data\" in spec \"{spec_name}\""
+        assert spec.get('csv_engine', CSV_ENGINE) in ('python', 'pyarrow'), \
+            f"Bad \"csv_engine\" in spec \"{spec_name}\""
         assert all(isinstance(i, str) for i in spec.get('insert_actions', [])), \
             f"Bad \"insert_actions\" in spec \"{spec_name}\""
         assert all(isinstance(i, str) for i in spec.get('validate_actions', [])), \
             f"Bad \"validate_actions\" in spec \"{spec_name}\""
         assert all(isinstance(i, str) for i in spec.get('process_actions', [])), \
             f"Bad \"process_actions\" in spec \"{spec_name}\""
+        assert not spec.get('staging') or (
+            isinstance(spec['staging'], dict)
+            and isinstance(spec['staging'].get('table'), str)
+            and isinstance(spec['staging'].get('columns'), dict)
+            and spec['staging']['columns']
+            ), f"Bad \"staging\" in spec \"{spec_name}\""
         assert spec.get('insert_actions') is None or \
             spec.get('insert_data') is None or \
             len(spec['insert_actions']) == len(spec['insert_data']), \
@@ -950,163 +1767,41 @@ def process_spec(con, spec_name, spec, input_file, stat):
         if spec.get('setup'):
             logger.debug('-- spec setup')
             exec_sql(con, spec['setup'])
-
-        cur = con.cursor()
-        count = 0
-        idata = []
-        icount = []
-        iload = None
-        istmt = []
-        for ifile in target_files:
-
-            if file_ext == 'zip':
-                # unzip if zipfile contains the only file that meets the requirements
-                import zipfile
-                with zipfile.ZipFile(ifile) as zf:
-                    inner_file = zf.namelist()
-                    assert len(inner_file) == 1, \
-                        f"More than 1 member in file {ifile}"
-                    inner_file = inner_file[0]
-                    assert os.path.basename(inner_file) == inner_file, \
-                        f"Zip file member has path in file {ifile}"
-                    inner_name, inner_ext = inner_file.rsplit('.', 1)
-                    ifile_path, ifile_name = os.path.split(ifile)
-                    assert ifile_name.rsplit('.', 1)[0] in (inner_file, inner_name), \
-                        f"Zip file member name is inconsistent with file name {ifile}"
-                    assert inner_ext in ('csv', 'json', 'xlsx') or spec.get('text_lines', False), \
-                        f"Zip file member has bad extension \"{inner_ext}\" in file {ifile}"
-                    assert inner_ext != 'json' or spec.get('insert_data'), \
-                        f"Missing \"insert_data\" in spec \"{spec_name}\""
-                    zf.extractall(ifile_path)
-                    extracted_file = os.path.join(ifile_path, inner_file)
-                if os.path.isfile(extracted_file):
-                    if args.delete or spec.get('delete'):
-                        os.remove(ifile)
-                    ifile = extracted_file
-                    in_format = inner_ext
-            else:
-                in_format = file_ext
-
-            # open file for reading
-            if spec.get('text_lines', False):
-                file = open(ifile, 'r', encoding=spec.get('encoding', ENCODING))
-                reader = file
-            elif in_format == 'csv':
-                file = open(ifile, 'r', encoding=spec.get('encoding', ENCODING))
-                if spec.get('csv_dialect', CSV_DIALECT) == 'naive':
-                    reader = \
-                        naive_csv_reader(
-                            file,
-                            delimiter=spec.get('csv_delimiter', CSV_DELIMITER)
-                        )
-                else:
-                    reader = \
-                        csv.reader(
-                            file,
-                            dialect=spec.get('csv_dialect', CSV_DIALECT),
-                            delimiter=spec.get('csv_delimiter', CSV_DELIMITER)
-                            #quotechar=spec.get('csv_quotechar', CSV_QUOTECHAR)
-                        )
-            elif in_format == 'xlsx':
-                wb = load_workbook(filename=ifile, read_only=True)
-                #reader = wb.worksheets[0]
-                reader = wb.worksheets[0].values
-            elif in_format == 'json':
-                file = open(ifile, 'r', encoding=spec.get('encoding', ENCODING))
-                reader = json.load(file)
-                assert isinstance(reader, list), f"Bad json file {ifile}"
-
-            # load data from file
-            if rows_per_load == -1:
-                # rows of each input file go to a separate load
-                count = 0
-                idata = []
-                icount = []
-                iload = None
-                istmt = []
-            line_no = 0
-            for row in reader:
-
-                # create header in table ida
-                if not iload:
-                    file_ = filename if rows_per_load != -1 else os.path.basename(ifile)
-                    iload = IDA_INSERT_HEADER[source['database']](cur, USER_ID, file_, spec_name, load_args or [None])
-                    con.commit()
-
-                count += 1
-                line_no += 1
-                if line_no <= spec.get('skip_lines', 0):
-                    continue
-
-                # prepare insert statements and data to insert
-                for n, func in enumerate(spec.get('insert_data', [None])):
-                    if len(idata) == n:
-                        idata.append([])
-                        istmt.append(spec['insert_actions'][n] if spec.get('insert_actions') else None)
-                        if istmt[-1]:
-                            logger.debug("-- stmt #%s\n\n%s\n", n, istmt[-1].strip())
-                        icount.append(0)
-                    insert_data = \
-                        func(row) if func and func.__code__.co_argcount == 1 else \
-                        func(line_no, row) if func and func.__code__.co_argcount == 2 else \
-                        func(iload, count, row) if func and func.__code__.co_argcount == 3 else \
-                        [row] if spec.get('text_lines', False) else \
-                        row
-                    if not insert_data:
-                        # insert no row
-                        pass
-                    elif isinstance(insert_data, (list, tuple)) and not isinstance(insert_data[0], (list, tuple)):
-                        # insert a row
-                        if spec.get('insert_actions') and spec['insert_actions'][n]:
-                            idata[n].append(insert_data)
-                        else:
-                            idata[n].append((iload, count, *insert_data))
-                            if not istmt[n] and idata[n][-1]:
-                                istmt[n] = IDA_BUILD_INSERT_ROW[source['database']](idata[n][-1])
-                                logger.debug("-- stmt #%s\n\n%s\n", n, istmt[n].strip())
-                    elif isinstance(insert_data, (list, tuple)) and isinstance(insert_data[0], (list, tuple)):
-                        # insert many rows
-                        if spec.get('insert_actions') and spec['insert_actions'][n]:
-                            idata[n].extend(insert_data)
-                        else:
-                            idata[n].extend([(iload, count, n, i+1, *irow) for i, irow in enumerate(insert_data)])
-                            if not istmt[n] and idata[n][-1]:
-                                istmt[n] = IDA_BUILD_INSERT_ROWS[source['database']](idata[n][-1])
-                                logger.debug("-- stmt #%s\n\n%s\n", n, istmt[n].strip())
-
-                # insert prepared data
-                for n in range(len(idata)):
-                    if len(idata[n]) >= BATCH_SIZE:
-                        IDA_INSERT_MANY_ROWS[source['database']](cur, istmt[n], idata[n])
-                        icount[n] += len(idata[n])
-                        idata[n].clear()
-
-            if in_format in ('csv', 'json') or spec.get('text_lines', False):
-                file.close()
-            elif in_format == 'xlsx':
-                wb.close()
-
-            # insert the rest of prepared data before removing the file
-            for n in range(len(idata)):
-                if idata[n]:
-                    IDA_INSERT_MANY_ROWS[source['database']](cur, istmt[n], idata[n])
-                    icount[n] += len(idata[n])
-                    idata[n].clear()
-
-            logger.info("%s", ifile)
-            if rows_per_load == -1:
-                logger.info("Loaded %s of %s rows with iload=%s", str(icount).strip('[]'), count - spec.get('skip_lines', 0), iload)
-                # Do the spec's validate_ and process_actions.
-                do_actions(spec, source, con, cur, iload)
+            # file workers load on their own connections
+            con.commit()
+        if spec.get('staging'):
+            logger.debug('-- spec staging')
+            exec_sql(
+                con,
+                IDA_CREATE_STAGING[source['database']].format(
+                    table=spec['staging']['table'],
+                    columns=',\n    '.join(f"{name} {type_}" for name, type_ in spec['staging']['columns'].items())
+                )
+            )
             con.commit()
 
-            if args.delete or spec.get('delete') or file_ext == 'zip':
-                os.remove(ifile)
+        file_workers = spec.get('file_workers', 1)
+        if rows_per_load == -1 and file_workers > 1 and len(target_files) > 1:
+            # files go to separate loads, so load them in parallel
+            files = queue.Queue()
+            for ifile in target_files:
+                files.put(ifile)
+            threads = [
+                ReturnValueThread(
+                    target=load_files_worker,
+                    args=(spec_name, spec, files, filename, file_ext, load_args)
+                )
+                for _ in range(min(file_workers, len(target_files)))
+            ]
+            for t in threads:
+                t.start()
+            error_count = sum(t.join() for t in threads)
+            assert error_count == 0, \
+                f"{error_count} of {len(target_files)} files failed to load in spec \"{spec_name}\""
+        else:
+            load_files(con, spec_name, spec, target_files, filename, file_ext, load_args, checkpoints=True)
 
-        if rows_per_load == 0:
-            logger.info("Loaded %s of %s rows with iload=%s", str(icount).strip('[]'), count - spec.get('skip_lines', 0), iload)
-            # Do the spec's validate_ and process_actions.
-            do_actions(spec, source, con, cur, iload)
+        cur = con.cursor()
 
         # Delete old loads from ida preserving only last N loads.
         cur.execute(
@@ -1129,10 +1824,8 @@ def process_spec(con, spec_name, spec, input_file, stat):
         con.rollback()
         return_code = 1
     finally:
-        if file:
-            file.close()
-        if wb:
-            wb.close()
+        if cur:
+            cur.close()
     return return_code
 
 
@@ -1153,36 +1846,32 @@ class ReturnValueThread(threading.Thread):
         return self.result
 
 
-def worker(list_of_arg_tuples):
+def worker(todo):
     error_count = 0
     connections = dict()
 
-    for arg_tuple in list_of_arg_tuples:
+    while True:
+        # take the next spec as soon as this worker is free
+        try:
+            arg_tuple = todo.get_nowait()
+        except queue.Empty:
+            break
         spec_name, spec, in_file, stat = arg_tuple
 
         # get worker connection for the spec
         source_name = spec['source']
         if not connections.get(source_name):
-            source = sources[source_name]
-            connections[source_name] = \
-                source['lib'].connect(source['con_string'], **source.get('con_kwargs', dict())) \
-                if source.get('con_string') else \
-                source['lib'].connect(**source['con_kwargs'])
-            if source.get('setup'):
-                logger.debug('-- setup')
-                exec_sql(connections[source_name], source['setup'])
+            connections[source_name] = connect(sources[source_name])
         con = connections[source_name]
 
         # execute the spec
+        started = perf_counter()
         error_count += process_spec(con, spec_name, spec, in_file, stat)
+        stat[spec_name]['duration'] = perf_counter() - started
 
     # shutdown all worker connections
     for source_name, con in connections.items():
-        source = sources[source_name]
-        if source.get('upset'):
-            logger.debug('-- upset')
-            exec_sql(con, source['upset'])
-        con.close()
+        disconnect(con, sources[source_name])
 
     return error_count
 
@@ -1239,10 +1928,17 @@ def main():
             todo.append((spec_name, spec, args.in_file, stat))
             #error_count += process_spec(spec_name, spec, args.in_file, stat)
 
+    # let worker threads take specs from the shared queue
+    if LONGEST_FIRST:
+        todo.sort(key=lambda arg_tuple: stat[arg_tuple[0]].get('duration', float('inf')), reverse=True)
+    todo_queue = queue.Queue()
+    for arg_tuple in todo:
+        todo_queue.put(arg_tuple)
+
     # create and start worker threads
     threads = []
     for i in range(PARALLEL_WORKERS):
-        threads.append(ReturnValueThread(target=worker, args=(todo[i::PARALLEL_WORKERS],)))
+        threads.append(ReturnValueThread(target=worker, args=(todo_queue,)))
         threads[-1].start()
     # wait for all worker threads to terminate
     for thread in threads:
@@ -7,7 +7,10 @@ import logging
 import re
 from datetime import date, datetime
 #import concurrent.futures
+import json
+import queue
 import threading
+from time import perf_counter
 
 from jinja2 import (
     Template,
@@ -78,6 +81,8 @@ if not os.path.isdir(OUT_DIR):
 OUT_FILE = os.path.join(OUT_DIR, '{}.html')
 
 PARALLEL_WORKERS = min(getattr(cfg, 'PARALLEL_WORKERS', 1), 8)
+# run specs longest first, by their durations in previous runs
+LONGEST_FIRST = getattr(cfg, 'LONGEST_FIRST', False)
 
 DEBUGGING = getattr(cfg, 'DEBUGGING', False)
 LOGGING = getattr(cfg, 'LOGGING', DEBUGGING)
@@ -110,6 +115,8 @@ DATE_FORMAT = getattr(cfg, 'DATE_FORMAT', '%Y-%m-%d')
 
 # number of rows to fetch with one fetch
 ONE_FETCH_ROWS = 5000
+# durations of specs in previous runs
+STAT_FILE = os.path.join(TEMP_DIR, f".dtest.{CFG_MODULE}.json")
 
 SPEC_REPORT_TEMPLATE="""
 <!DOCTYPE html>
@@ -312,11 +319,16 @@ class ReturnValueThread(threading.Thread):
         return self.result
 
 
-def worker(list_of_arg_tuples):
+def worker(todo):
     error_count = 0
     connections = dict()
 
-    for arg_tuple in list_of_arg_tuples:
+    while True:
+        # take the next spec as soon as this worker is free
+        try:
+            arg_tuple = todo.get_nowait()
+        except queue.Empty:
+            break
         run, spec_name, spec = arg_tuple
 
         # get worker connection for the spec
@@ -333,7 +345,9 @@ def worker(list_of_arg_tuples):
         con = connections[source_name]
 
         # execute the spec
+        started = perf_counter()
         error_count += process_spec(con, run, spec_name, spec)
+        spec['duration'] = perf_counter() - started
 
     # shutdown all worker connections
     for source_name, con in connections.items():
@@ -357,6 +371,12 @@ def main():
     ]
     logger.info(f"run {run[0]} with {PARALLEL_WORKERS} thread(s)")
 
+    if os.path.isfile(STAT_FILE):
+        with open(STAT_FILE, encoding='UTF-8') as f:
+            stat = json.load(f)
+    else:
+        stat = dict()
+
     error_count = 0
     todo = []
     for spec_name, spec in specs.items():
@@ -392,15 +412,29 @@ def main():
             todo.append((run, spec_name, spec))
             #error_count += process_spec(run, spec_name, spec)
 
+    # let worker threads take specs from the shared queue
+    if LONGEST_FIRST:
+        todo.sort(key=lambda arg_tuple: stat.get(arg_tuple[1], {}).get('duration', float('inf')), reverse=True)
+    todo_queue = queue.Queue()
+    for arg_tuple in todo:
+        todo_queue.put(arg_tuple)
+
     # create and start worker threads
     threads = []
     for i in range(PARALLEL_WORKERS):
-        threads.append(ReturnValueThread(target=worker, args=(todo[i::PARALLEL_WORKERS],)))
+        threads.append(ReturnValueThread(target=worker, args=(todo_queue,)))
         threads[-1].start()
     # wait for all worker threads to terminate
     for thread in threads:
         error_count += thread.join()
 
+    for spec_name, spec in specs.items():
+        if spec.get('duration') is not None:
+            stat[spec_name] = dict(stat.get(spec_name, {}), duration=spec['duration'])
+    stat = {k: v for k, v in stat.items() if k in specs}
+    with open(STAT_FILE, 'w', encoding='UTF-8') as f:
+        f.write(json.dumps(stat))
+
     # create run report
     run_results = [
         (spec['safe_name'], spec.get('result', -1), spec.get('warnings'), spec['source'], spec.get('doc'))
@@ -17,6 +17,16 @@ SOURCES = ["ONE", "TWO"]
 sources["ONE"] = sources["sqlite_source"]
 sources["TWO"] = sources["sqlite_source"]
 DDIFF_SOURCE = sources["sqlite_source"]
+# separate sqlite databases make DB1 and DB2 distinct from each other and
+# from the ddiff database, as if they were on different servers
+sources["ONE_DB"] = {
+    "database": "sqlite",
+    "con_string": os.path.join(os.path.expanduser('~'), '.dbang', 'ddiff_test_one.db')
+}
+sources["TWO_DB"] = {
+    "database": "sqlite",
+    "con_string": os.path.join(os.path.expanduser('~'), '.dbang', 'ddiff_test_two.db')
+}
 
 #RUN_REPORT_TEMPLATE = 'ddiff_test_run.html.jinja'
 #SPEC_REPORT_TEMPLATE = 'ddiff_test_spec.html.jinja'
@@ -168,6 +178,377 @@ specs = {
             """
        ]
     },
+    "current.hash": {
+        "tags": ['failure', 'hash'],
+        "doc": "Intentionally failed",
+        "engine": "hash",
+        "pk": ["c1"],
+        "queries": [
+            """
+            select 1 c1, current_timestamp c2, 3 c3
+            union all
+            select 2 c1, current_timestamp c2, 5 c3
+            union all
+            select 3 c1, current_timestamp c2, 7 c3
+            union all
+            select 5 c1, current_timestamp c2, 1 c3
+            """,
+            """
+            select 1 c1, datetime(current_timestamp, '+5 second') c2, 3 c3
+            union all
+            select 2 c1, current_timestamp c2, 6 c3
+            union all
+            select 4 c1, current_timestamp c2, 9 c3
+            union all
+            select 5 c1, current_timestamp c2, 1 c3
+            """
+       ],
+        #
+        # level 2
+        #
+        "current.hash": {
+            "pk": ["c1", "c3"],
+            "queries": [
+                """
+                select 1 c1, 3 c3, 0.50 c4
+                where 1 = {{argrows[0][0]}}
+                """,
+                """
+                select 1 c1, 3 c3, 0.5 c4
+                where 1 = {{argrows[0][0]}}
+                """
+            ]
+        }
+    },
+    "current.merge": {
+        "tags": ['failure', 'merge'],
+        "doc": "Intentionally failed",
+        "engine": "merge",
+        "pk": ["c1"],
+        "queries": [
+            """
+            select 1 c1, current_timestamp c2, 3 c3
+            union all
+            select 2 c1, current_timestamp c2, 5 c3
+            union all
+            select 3 c1, current_timestamp c2, 7 c3
+            union all
+            select 5 c1, current_timestamp c2, 1 c3
+            """,
+            """
+            select 1 c1, datetime(current_timestamp, '+5 second') c2, 3 c3
+            union all
+            select 2 c1, current_timestamp c2, 6 c3
+            union all
+            select 4 c1, current_timestamp c2, 9 c3
+            union all
+            select 5 c1, current_timestamp c2, 1 c3
+            """
+       ],
+        #
+        # level 2
+        #
+        "current.merge": {
+            "pk": ["c1", "c3"],
+            "queries": [
+                """
+                select 1 c1, 3 c3, 0.50 c4
+                where 1 = {{argrows[0][0]}}
+                """,
+                """
+                select 1 c1, 3 c3, 0.5 c4
+                where 1 = {{argrows[0][0]}}
+                """
+            ]
+        }
+    },
+    "nocase.merge": {
+        "tags": ['failure', 'merge'],
+        "doc": "Intentionally failed: pk of DB2 is ordered case-insensitively",
+        "engine": "merge",
+        "pk": ["k"],
+        "queries": [
+            """
+            select 'B' k, 1 v
+            union all
+            select 'a', 2
+            union all
+            select 'c', 3
+            """,
+            """
+            select k collate nocase k, v
+            from (
+                select 'a' k, 2 v
+                union all
+                select 'B', 1
+                union all
+                select 'C', 3
+            ) t
+            """
+        ]
+    },
+    "int_text.merge": {
+        "tags": ['failure', 'merge'],
+        "doc": "Intentionally failed: pk is integer in DB1 and text in DB2",
+        "engine": "merge",
+        "pk": ["k"],
+        "queries": [
+            """
+            select 9 k, 1 v
+            union all
+            select 10, 2
+            union all
+            select 11, 3
+            """,
+            """
+            select '9' k, 1 v
+            union all
+            select '10', 2
+            union all
+            select '12', 3
+            """
+        ]
+    },
+    "1000.buckets": {
+        "tags": ['failure', 'buckets'],
+        "doc": "Intentionally failed",
+        "buckets": 8,
+        "pk": ["n"],
+        "queries": [
+            """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select n, 'qwerty' q, 0.5 * n f
+            from numbers
+            """,
+            """
+            with recursive numbers (n) as (
+                select 1 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 1000
+            )
+            select n, case when n = 500 then 'asdfgh' else 'qwerty' end q, 0.5 * n f
+            from numbers
+            """
+        ]
+    },
+    "null_pk": {
+        "tags": ['failure', 'buckets'],
+        "doc": "Intentionally failed: rows with NULL in pk are discrepancies",
+        "pk": ["n"],
+        "queries": [
+            """
+            select 1 n, 'qwerty' q
+            union all
+            select null, 'null pk'
+            """,
+            """
+            select 1 n, 'asdfgh' q
+            union all
+            select null, 'null pk'
+            """
+        ]
+    },
+    "null_pk.buckets": {
+        "tags": ['failure', 'buckets'],
+        "doc": "Intentionally failed: the same discrepancies as null_pk",
+        "buckets": 8,
+        "pk": ["n"],
+        "queries": [
+            """
+            select 1 n, 'qwerty' q
+            union all
+            select null, 'null pk'
+            """,
+            """
+            select 1 n, 'asdfgh' q
+            union all
+            select null, 'null pk'
+            """
+        ]
+    },
+    "1000.max_rows": {
+        "tags": ['failure', 'max_rows'],
+        "doc": "Intentionally failed",
+        "max_rows": 500,
+        "pk": ["n"],
+        "queries": [
+            """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select n, 'qwerty' q
+            from numbers
+            """,
+            """
+            with recursive numbers (n) as (
+                select 1 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 1000
+            )
+            select n, 'qwerty' q
+            from numbers
+            """
+        ]
+    },
+    "1000.sequential": {
+        "tags": ['failure', 'sequential'],
+        "doc": "Intentionally failed",
+        "parallel_fetch": False,
+        "pk": ["n"],
+        "queries": [
+            """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select n, 'qwerty' q
+            from numbers
+            """,
+            """
+            with recursive numbers (n) as (
+                select 1 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 1000
+            )
+            select n, 'qwerty' q
+            from numbers
+            """
+        ]
+    },
+    "12000.fetch": {
+        "tags": ['failure', 'rounds'],
+        "doc": "Intentionally failed: DB1 and DB2 are fetched in rounds concurrently",
+        "sources": ["ONE_DB", "TWO_DB"],
+        "pk": ["n"],
+        "queries": [
+            """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 11999
+            )
+            select n, 'qwerty' q
+            from numbers
+            """,
+            """
+            with recursive numbers (n) as (
+                select 1 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 12000
+            )
+            select n, case when n = 6000 then 'asdfgh' else 'qwerty' end q
+            from numbers
+            """
+        ]
+    },
+    "12000.sequential": {
+        "tags": ['failure', 'rounds', 'sequential'],
+        "doc": "Intentionally failed: DB1 and DB2 are fetched in rounds one by one",
+        "sources": ["ONE_DB", "TWO_DB"],
+        "parallel_fetch": False,
+        "pk": ["n"],
+        "queries": [
+            """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 11999
+            )
+            select n, 'qwerty' q
+            from numbers
+            """,
+            """
+            with recursive numbers (n) as (
+                select 1 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 12000
+            )
+            select n, case when n = 6000 then 'asdfgh' else 'qwerty' end q
+            from numbers
+            """
+        ]
+    },
+    "12000.ddiff_db1": {
+        "tags": ['failure', 'rounds'],
+        "doc": "Intentionally failed: DB1 is the ddiff database, DB2 is fetched in rounds",
+        "sources": ["ONE", "TWO_DB"],
+        "pk": ["n"],
+        "queries": [
+            """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 11999
+            )
+            select n, 'qwerty' q
+            from numbers
+            """,
+            """
+            with recursive numbers (n) as (
+                select 1 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 12000
+            )
+            select n, case when n = 6000 then 'asdfgh' else 'qwerty' end q
+            from numbers
+            """
+        ]
+    },
+    "temp-setups": {
+        "tags": ['failure', 'setup', 'upset', 'rounds'],
+        "doc": "Intentionally failed: queries read temporary tables of the setups' sessions",
+        "sources": ["ONE_DB", "TWO_DB"],
+        "setups": [
+            [
+                "create temp table ddiff_test_tt (a int, b text)",
+                "insert into ddiff_test_tt values (1, 'hello'), (2, 'world')"
+            ],
+            [
+                "create temp table ddiff_test_tt (a int, b text)",
+                "insert into ddiff_test_tt values (1, 'hello'), (2, 'there')"
+            ]
+        ],
+        "pk": ["a"],
+        "queries": [
+            "select a, b from ddiff_test_tt",
+            "select a, b from ddiff_test_tt"
+        ],
+        "upsets": [
+            "drop table ddiff_test_tt",
+            "drop table ddiff_test_tt"
+        ]
+    },
     "nested-with-setup-and-upset": {
         "tags": ['setup', 'upset'],
         "doc": "First setup DB stuff and then release it.",
@@ -87,6 +87,51 @@ specs = {
             "header": ["Name", "А2", "А3", "Code"]
         }
     },
+    "csv_gz": {
+        "tags": ["csv", "gz"],
+        "fi": {"file": "test.csv"},
+        "fo": {"file": "dfifo_test_csv.csv.gz"}
+    },
+    "csv_arrow_csv": {
+        "tags": ["csv", "arrow"],
+        "fi": {"file": "test.csv", "csv_engine": "pyarrow"},
+        "fo": {"file": "dfifo_test_csv_arrow.csv"}
+    },
+    "csv_arrow_ragged_csv": {
+        "tags": ["csv", "arrow"],
+        "fi": {"file": "test_ragged.csv", "csv_engine": "pyarrow"},
+        "fo": {"file": "dfifo_test_csv_arrow_ragged.csv"}
+    },
+    "gz_csv": {
+        "tags": ["csv", "gz"],
+        "fi": {"file": "test.csv.gz"},
+        "fo": {"file": "dfifo_test_gz.csv"}
+    },
+    "csv_xlsx_zip": {
+        "tags": ["csv", "zip"],
+        "fi": {"file": "test.csv"},
+        "fo": {
+            "file": "dfifo_test_csv_zip.xlsx.zip",
+            "header": ["Name", "А2", "А3", "Code"]
+        }
+    },
+    "csv_parquet": {
+        "tags": ["csv", "parquet"],
+        "fi": {"file": "test.csv"},
+        "fo": {
+            "file": "dfifo_test_csv.parquet",
+            "header": ["Name", "А2", "А3", "Code"]
+        }
+    },
+    "csv_split_arrow": {
+        "tags": ["csv", "split", "arrow"],
+        "fi": {"file": "test.csv"},
+        "fo": {
+            "file": "dfifo_test_csv_split_%(seqn)06i.arrow",
+            "header": ["Name", "А2", "А3", "Code"],
+            "rows_per_file": 100
+        }
+    },
     "csv_parts_json": {
         "tags": ["csv", "parts"],
         "fi": {"file": "test_000???.csv"},
@@ -154,6 +199,19 @@ specs = {
             "header": ["code", "name"]
         },
     },
+    "csv_batch_csv": {
+        "tags": ["csv", "batch"],
+        "fi": {
+            "file": "test.csv",
+            "transformer_batch": True,
+            "transformer": lambda rows: [(row[3], name) for row in rows for name in (row[0], row[0].upper())]
+        },
+        "fo": {
+            "file": "dfifo_test_csv_batch_%(seqn)06i.csv",
+            "header": ["code", "name"],
+            "rows_per_file": 100
+        },
+    },
     "json_csv": {
         "tags": ["json"],
         "fi": {
@@ -173,6 +231,17 @@ specs = {
             "header": ["Код", "А2", "А3", "Название"]
         }
     },
+    "json_lines_json": {
+        "tags": ["json"],
+        "fi": {
+            "file": "test_lines.json",
+            "transformer": lambda row: (row["code"], row.get("alpha2"), row.get("alpha3"), row["name"])
+        },
+        "fo": {
+            "file": "dfifo_test_json_lines.json",
+            "header": ["Код", "А2", "А3", "Название"]
+        }
+    },
     "json_html": {
         "tags": ["json"],
         "fi": {
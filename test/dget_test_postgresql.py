@@ -23,6 +23,8 @@ CSV_DELIMITER = ';'
 #DATE_FORMAT = '%x'
 
 SOURCE = "postgresql_source"
+# the same source with server-side cursor
+sources["postgresql_streaming"] = dict(sources["postgresql_source"], server_cursor=True)
 PRESERVE_N_TRACES = 3
 
 specs = {
@@ -189,4 +191,24 @@ specs = {
         "csv.dialect": "naive",
         "csv.encoding": 'cp1251'
     },
+    "streaming": {
+        "source": "postgresql_streaming",
+        "file": "dget_streaming_%(seqn)06i.csv",
+        "tags": ['streaming'],
+        "rows_per_file": 300,
+        "fetch_rows": 100,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "csv.encoding": 'cp1251'
+    },
 }
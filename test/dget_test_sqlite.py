@@ -1,5 +1,7 @@
 import os
 import sys
+import sqlite3
+import decimal
 
 from sources import sources
 
@@ -23,6 +25,11 @@ CSV_DELIMITER = ';'
 #DATE_FORMAT = '%x'
 
 SOURCE = "sqlite_source"
+# the same source with server-side cursor
+sources["sqlite_streaming"] = dict(sources["sqlite_source"], server_cursor=True)
+# the same source returning Decimal for columns named like "d [decimal]"
+sqlite3.register_converter("decimal", lambda b: decimal.Decimal(b.decode()))
+sources["sqlite_decimal"] = dict(sources["sqlite_source"], con_kwargs={"detect_types": sqlite3.PARSE_COLNAMES})
 PRESERVE_N_TRACES = 3
 
 specs = {
@@ -100,6 +107,26 @@ specs = {
         "html.title": "1000 rows",
         "html.header": False
     },
+    "1000.gz": {
+        "file": "dget_1000_gz.csv.gz",
+        "tags": ['1000', 'gz'],
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "csv.encoding": 'cp1251',
+        "csv.header": False,
+        "html.title": "1000 rows",
+        "html.header": False
+    },
     "by_100": {
         "file": "dget_%(datetime)s_%(seqn)06i_by_100.csv",
         "rows_per_file": 100,
@@ -139,6 +166,132 @@ specs = {
         "html.header": False,
         "xlsx.header": False
     },
+    "1000.json": {
+        "file": "dget_1000.json",
+        "tags": ['1000', 'json'],
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "json.encoding": 'cp1251'
+    },
+    "by_100.json": {
+        "file": "dget_%(seqn)06i_by_100.json",
+        "tags": ['json'],
+        "rows_per_file": 100,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "json.lines": True
+    },
+    "by_100.parquet": {
+        "file": "dget_%(seqn)06i_by_100.parquet",
+        "tags": ['parquet'],
+        "rows_per_file": 100,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "parquet.compression": 'zstd'
+    },
+    "decimal_and_nulls.parquet": {
+        "source": "sqlite_decimal",
+        "file": "dget_decimal_and_nulls.parquet",
+        "tags": ['parquet'],
+        "fetch_rows": 100,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select
+                n,
+                cast(case when n < 100 then n + 0.5 else n + 0.25 end as text) as "d [decimal]",
+                case when n < 100 then null else n end as late
+            from numbers
+            """
+    },
+    "1000.arrow.zip": {
+        "file": "dget_1000.arrow.zip",
+        "tags": ['1000', 'arrow', 'zip'],
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp']
+    },
+    "fetch_auto": {
+        "file": "dget_fetch_auto.csv",
+        "tags": ['fetch'],
+        "fetch_rows": "auto",
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 99999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "csv.encoding": 'cp1251'
+    },
+    "fetch_by_300": {
+        "file": "dget_fetch_by_300_%(seqn)06i.html",
+        "tags": ['fetch'],
+        "fetch_rows": 300,
+        "rows_per_file": 500,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "html.encoding": 'UTF-8'
+    },
     "1000_custom": {
         "file": "dget_1000_custom.html",
         "tags": ['1000'],
@@ -194,4 +347,149 @@ specs = {
         "csv.dialect": "naive",
         "csv.encoding": 'cp1251'
     },
+    "streaming": {
+        "source": "sqlite_streaming",
+        "file": "dget_streaming_%(seqn)06i.csv",
+        "tags": ['streaming'],
+        "rows_per_file": 300,
+        "fetch_rows": 100,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty', 'привет', null, n, 0.0 + n, current_date, current_timestamp
+            from numbers
+            """,
+        "header": ['Q', 'hello', 'null', 'int', 'float', 'date', 'timestamp'],
+        "csv.encoding": 'cp1251'
+    },
+    "partition_ranges": {
+        "file": "dget_partition_ranges.csv",
+        "tags": ['partition'],
+        "partition_by": {"column": "n", "ranges": [(None, 250), (250, 500), (500, 750), (750, None)]},
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty' as q, n, 0.0 + n as f
+            from numbers
+            """,
+        "csv.encoding": 'cp1251'
+    },
+    "partition_buckets": {
+        "file": "dget_partition_buckets_%(part)s.json",
+        "tags": ['partition'],
+        "partition_by": {"column": "n", "buckets": 3},
+        "json.lines": True,
+        "query": """
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 999
+            )
+            select 'qwerty' as q, n, 0.0 + n as f
+            from numbers
+            """,
+    },
+    "partition_buckets_signed": {
+        "file": "dget_partition_buckets_signed.csv",
+        "tags": ['partition'],
+        "partition_by": {"column": "n", "buckets": 4},
+        "query": """
+            with recursive numbers (n) as (
+                select -500 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 499
+            )
+            select 'qwerty' as q, n from numbers
+            union all
+            select 'null', null
+            union all
+            select 'null', null
+            """,
+        "csv.encoding": 'cp1251'
+    },
+    "partition_ranges_null": {
+        "file": "dget_partition_ranges_null.csv",
+        "tags": ['partition'],
+        "partition_by": {"column": "n", "ranges": [(None, 0), (0, None)]},
+        "query": """
+            with recursive numbers (n) as (
+                select -500 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 499
+            )
+            select 'qwerty' as q, n from numbers
+            union all
+            select 'null', null
+            """,
+        "csv.encoding": 'cp1251'
+    },
+    "partition_setup": {
+        "file": "dget_partition_setup.csv",
+        "tags": ['partition'],
+        "partition_by": {"column": "n", "ranges": [(None, 100), (100, None)]},
+        # the temp table of the setup is visible to every partition
+        "setup": [
+            "create temp table dget_partition_setup (n int not null)",
+            """
+            insert into dget_partition_setup
+            with recursive numbers (n) as (
+                select 0 as n
+                union all
+                select n + 1
+                from numbers
+                where n < 199
+            )
+            select n from numbers
+            """
+        ],
+        "query": "select n from dget_partition_setup",
+    },
+    "watermark": {
+        "file": "dget_watermark_%(datetime)s.csv",
+        "tags": ['watermark'],
+        "watermark": {"column": "n", "initial": -1},
+        # every run appends 1000 rows above the watermark of any previous run,
+        # so that it exports just these rows
+        "setup": [
+            "create table if not exists dget_watermark_test (n int not null)",
+            """
+            insert into dget_watermark_test (n)
+            with recursive numbers (k, n) as (
+                select 1, max(coalesce(max(n), -1) + 1, strftime('%s', 'now') * 1000)
+                from dget_watermark_test
+                union all
+                select k + 1, n + 1
+                from numbers
+                where k < 1000
+            )
+            select n
+            from numbers
+            """,
+            # keep the table small
+            "delete from dget_watermark_test where n < (select max(n) from dget_watermark_test) - 1999"
+        ],
+        "query": """
+            select 'qwerty' as q, n, 0.0 + n as f
+            from dget_watermark_test
+            where n > :watermark
+            order by n
+            """,
+        "csv.encoding": 'cp1251'
+    },
 }
@@ -0,0 +1,65 @@
+import os
+import sys
+
+from sources import sources
+
+#
+# Run the test of resuming an interrupted load with command lines
+#     DPUT_TEST_INTERRUPT_LINE=150 dput.py test/dput05_test_sqlite all
+#     dput.py test/dput05_test_sqlite all
+# The first run fails at line 150 leaving a checkpoint, the second one
+# resumes the load from the checkpoint. Run the second one with --force
+# to see the load started from scratch. See log file in log/ directory.
+#
+
+#
+# SETTINGS USED BY dput
+#
+# defaults to current working directory
+IN_DIR = os.path.join(os.path.dirname(__file__), '..', 'in')
+# defaults to False
+DEBUGGING = True
+# defaults to False
+LOGGING = True
+# defaults to current working directory
+LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'log')
+# input files' encoding
+ENCODING = 'cp1251'
+# defaults to the dialect delimiter
+CSV_DELIMITER = ';'
+# data source
+SOURCE = "sqlite_source"
+
+#
+# SETTINGS USED IN specs
+#
+INTERRUPT_LINE = int(os.environ.get('DPUT_TEST_INTERRUPT_LINE', 0))
+
+def interrupt(line_no, row):
+    # fail the load at the line to leave its checkpoint behind
+    if line_no == INTERRUPT_LINE:
+        raise RuntimeError(f"Load interrupted at line {line_no}")
+    return row
+
+
+specs = {
+    "csv_resume_test": {
+        "tags": ['csv', 'ida', 'checkpoint'],
+        "file": "test.csv",
+        "force": True,
+        "batch_size": 20,
+        "checkpoint_batches": 2,
+        "insert_data": interrupt,
+        # all 247 lines of test.csv are loaded once
+        "validate_actions": [
+            """
+            update ida_lines set
+                istat = 2,
+                ierrm = 'Lines are lost or loaded twice.'
+            where iload = ?1
+                and (select count(distinct iline) || '/' || count(*) from ida_lines where iload = ?1) <> '247/247'
+            """
+        ],
+        "process_actions": "delete from ida where iload = ?"
+    },
+}
@@ -159,11 +159,143 @@ specs = {
         "setup": CREATE_TABLE_TEST.format('dput_csv_test_test'),
         "upset": "drop table dput_csv_test_test"
     },
+    "csv_bad_rows_test": {
+        "tags": ['csv', 'bad_rows'],
+        "file": "test.csv",
+        "batch_size": 50,
+        "skip_bad_rows": True,
+        "insert_actions": "insert into dput_csv_bad_rows_test (code, name, alpha2, alpha3) values (?, ?, ?, ?)",
+        # names of Z-countries violate "not null"
+        "insert_data": lambda row: (row[3], row[0] if row[0][0] != 'Z' else None, row[1], row[2]),
+        "process_actions": "delete from ida where iload = ?",
+        "setup": CREATE_TABLE_TEST.format('dput_csv_bad_rows_test'),
+        "upset": "drop table dput_csv_bad_rows_test"
+    },
     "csv_parts_test": {
         "tags": ['csv', 'ida'],
         "file": "test_000???.csv",
         "process_actions": "delete from ida where iload = ?"
     },
+    "csv_parts_parallel_test": {
+        "tags": ['csv', 'ida', 'parallel'],
+        "file": "test_000???.csv",
+        "rows_per_load": -1,
+        "file_workers": 3,
+        "process_actions": "delete from ida where iload = ?"
+    },
+    "csv_parts_parallel_actions_test": {
+        "tags": ['csv', 'parallel'],
+        "file": "test_000???.csv",
+        "rows_per_load": -1,
+        "file_workers": 3,
+        "insert_actions": "insert into dput_csv_parts_parallel_test (code, name, alpha2, alpha3) values (?, ?, ?, ?)",
+        "insert_data": lambda row: (row[3], row[0], row[1], row[2]),
+        "process_actions": "delete from ida where iload = ?",
+        # setup and upset are done once, not by each file worker
+        "setup": CREATE_TABLE_TEST.format('dput_csv_parts_parallel_test'),
+        "upset": "drop table dput_csv_parts_parallel_test"
+    },
+    "csv_arrow_test": {
+        "tags": ['csv', 'ida', 'arrow'],
+        "file": "test.csv",
+        "csv_engine": "pyarrow",
+        "process_actions": "delete from ida where iload = ?"
+    },
+    "csv_arrow_ragged_test": {
+        "tags": ['csv', 'ida', 'arrow'],
+        # an empty line and rows with missing and extra fields
+        "file": "test_ragged.csv",
+        "csv_engine": "pyarrow",
+        "insert_data": lambda row: (row + ['', '', '', ''])[:4],
+        "process_actions": "delete from ida where iload = ?"
+    },
+    "csv_batch_test": {
+        "tags": ['csv', 'ida', 'batch'],
+        "file": "test.csv",
+        "batch_size": "auto",
+        "process_actions": "delete from ida where iload = ?"
+    },
+    "csv_insert_batch_test": {
+        "tags": ['csv', 'ida', 'batch'],
+        "file": "test.csv",
+        "insert_data_batch": True,
+        "insert_data": [
+            lambda rows: [(row[0], row[3]) for row in rows if row[0][0] in 'AEIOU'],
+            lambda rows: [(row[1], row[2]) for row in rows]
+        ],
+        "process_actions": "delete from ida where iload = ?"
+    },
+    "csv_insert_batch_lines_test": {
+        "tags": ['csv', 'ida', 'batch'],
+        "file": "test.csv",
+        "insert_data_batch": True,
+        # rows returned start with the numbers of their loaded lines
+        "insert_data": [
+            lambda ilines, rows: [(i, i, row[0]) for i, row in zip(ilines, rows) if row[0][0] in 'AEIOU'],
+            lambda ilines, rows: [(i, i, value) for i, row in zip(ilines, rows) for value in row[1:3]]
+        ],
+        # rows must keep the numbers of their lines, otherwise the check constraint fails the spec
+        "upset": [
+            "create temp table if not exists dput_assert (ok int check (ok = 1))",
+            """
+            insert into dput_assert
+            select count(*) > 0 and sum(iline != cast(c1 as int)) = 0 and max(nline) = 2
+            from ida_lines
+            where iload = (select max(iload) from ida where entity = 'csv_insert_batch_lines_test')
+            """,
+            "drop table dput_assert"
+        ]
+    },
+    "csv_checkpoint_test": {
+        "tags": ['csv', 'ida', 'checkpoint'],
+        "file": "test_000???.csv",
+        "batch_size": 20,
+        "checkpoint_batches": 2,
+        "process_actions": "delete from ida where iload = ?"
+    },
+    "csv_staging_test": {
+        "tags": ['csv', 'ida', 'staging'],
+        "file": "test.csv",
+        "staging": {
+            "table": "dput_csv_test_staging",
+            "columns": {"name": "varchar(50)", "alpha2": "char(2)", "alpha3": "char(3)", "code": "int"}
+        },
+        "insert_data": lambda row: (row[0], row[1], row[2], int(row[3])),
+        "validate_actions": [
+            """
+            update dput_csv_test_staging set
+                istat = 2,
+                ierrm = 'Bad code.'
+            where iload = ?
+                and not code between 1 and 999
+            """
+        ],
+        "process_actions": "delete from ida where iload = ?",
+        # test teardown
+        "upset": "drop table dput_csv_test_staging"
+    },
+    "csv_bad_rows_staging_test": {
+        "tags": ['csv', 'bad_rows', 'staging'],
+        "file": "test.csv",
+        "batch_size": 50,
+        "skip_bad_rows": True,
+        "staging": {
+            "table": "dput_csv_bad_rows_staging",
+            "columns": {"name": "varchar(50) not null", "alpha2": "char(2)", "alpha3": "char(3)", "code": "int"}
+        },
+        # names of Z-countries violate "not null", so the load fails
+        "insert_data": lambda row: (row[0] if row[0][0] != 'Z' else None, row[1], row[2], int(row[3])),
+        "validate_actions": [
+            """
+            update dput_csv_bad_rows_staging set
+                istat = 2,
+                ierrm = 'Bad code.'
+            where iload = ?
+                and not code between 1 and 999
+            """
+        ],
+        "upset": "drop table dput_csv_bad_rows_staging"
+    },
     "json_ida_test": {
         "tags": ['ida'],
         "encoding": "UTF-8",
@@ -194,6 +326,13 @@ specs = {
         ],
         "process_actions": "delete from ida where iload = ?"
     },
+    "json_lines_ida_test": {
+        "tags": ['ida'],
+        "encoding": "UTF-8",
+        "file": "test_lines.json",
+        "insert_data": lambda row: (row["code"], row["name"], row.get("alpha2"), row.get("alpha3")),
+        "process_actions": "delete from ida where iload = ?"
+    },
     "json_test_test": {
         "encoding": "UTF-8",
         "file": "test.json",
@@ -235,6 +374,30 @@ specs = {
         "file": "test_000???.xlsx",
         "process_actions": "delete from ida where iload = ?"
     },
+    "csv_validation_error_test": {
+        "tags": ['csv', 'ida'],
+        "file": "test.csv",
+        "validate_actions": [
+            """
+            update ida_lines set
+                istat = 2,
+                ierrm = 'Bad code.'
+            where iload = ?
+                and c4 = '004'
+            """
+        ],
+        # the load must fail validation, otherwise the check constraint fails the spec
+        "upset": [
+            "create temp table if not exists dput_assert (ok int check (ok = 1))",
+            """
+            insert into dput_assert
+            select istat = 2
+            from ida
+            where iload = (select max(iload) from ida where entity = 'csv_validation_error_test')
+            """,
+            "drop table dput_assert"
+        ]
+    },
     "csv_test_error": {
         "tags": ['csv'],
         "file": "test.csv",
@@ -386,6 +549,11 @@ specs = {
         "file": "test_zip.zip",
         "process_actions": "delete from ida where iload = ?"
     },
+    "gz_ida_test": {
+        "tags": ['zipped', 'ida'],
+        "file": "test.csv.gz",
+        "process_actions": "delete from ida where iload = ?"
+    },
     "setup_upset_test": {
         "tags": ['csv', 'ida', 'setup', 'upset'],
         "file": "test.csv",
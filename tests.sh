@@ -9,3 +9,10 @@ ddiff.py test/ddiff_test_$DBANGDB all
 dget.py test/dget_test_$DBANGDB all
 dput.py --force test/dput_test_$DBANGDB all
 dtest.py test/dtest_test_$DBANGDB all
+
+if [ "$DBANGDB" = "sqlite" ]
+then
+    # interrupt a load and resume it
+    DPUT_TEST_INTERRUPT_LINE=150 dput.py test/dput05_test_sqlite all
+    dput.py test/dput05_test_sqlite all
+fi